@@ -20,6 +20,7 @@ from cogs.utils import context as context_cls
 from cogs.utils.command_cog import CommandCog
 from cogs.utils.config import Config
 from cogs.utils.slash import SlashCommand
+from webhook_dispatcher import WebhookDispatcher
 
 __version__ = "1.1.0"
 bot_name = config.bot_name
@@ -69,6 +70,7 @@ class RedditModHelper(commands.AutoShardedBot):
         self.debug = sys.platform == "darwin"
         self.client_id = config.client_id
         self.session = aiohttp.ClientSession(loop=self.loop)
+        self.webhooks = WebhookDispatcher(session=self.session, logger=log)
         self._prev_events = deque(maxlen=10)
         self.owner_id = config.owner_id
         self.services = services
@@ -19,7 +19,7 @@ from asyncpraw.exceptions import InvalidURL
 from asyncpraw.models import Subreddit
 from asyncprawcore import NotFound
 from dateutil.relativedelta import relativedelta
-from discord import AllowedMentions, RequestsWebhookAdapter, Webhook
+from discord import AllowedMentions
 from discord.ext import tasks
 from discord_slash.cog_ext import cog_slash, cog_subcommand
 from discord_slash.utils.manage_commands import create_option
@@ -143,7 +143,8 @@ class Subscription:
     def __init__(self, result, cog, subreddit):
         self.subreddit = result.subreddit
         self.modlog_account = result.modlog_account
-        self.webhook = Webhook.from_url(result.alert_webhook, adapter=RequestsWebhookAdapter())
+        # sent through the bot's shared webhook dispatcher, see send_alert
+        self.webhook_url = result.alert_webhook
         self.item_type = result.item_type
         self.threshold = result.threshold
         self.check_interval = result.check_interval
@@ -186,8 +187,17 @@ class Subscription:
                 self.bot.log.exception(error)
 
     async def send_alert(self, submission_count, comment_count, total):
-        ...
-        # print()
+        # off unless the bot's config sets modqueue_alerts, start() calls this on every check over the threshold
+        if not getattr(self.bot.config, "modqueue_alerts", False):
+            return
+        embed = discord.Embed(
+            title=f"r/{self.subreddit} Modqueue Alert",
+            description=f"There are {total:,} items in the modqueue, the alert threshold is {self.threshold:,}.",
+            color=discord.Color.orange(),
+        )
+        embed.add_field(name="Submissions", value=f"{submission_count:,}")
+        embed.add_field(name="Comments", value=f"{comment_count:,}")
+        await self.bot.webhooks.send(self.webhook_url, embeds=[embed])
 
 
 class RedditStats(CommandCog):
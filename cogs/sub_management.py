@@ -1,6 +1,4 @@
-import os
 import time
-from subprocess import CalledProcessError, check_call
 
 import asyncpraw
 import credmgr
@@ -175,7 +173,6 @@ class SubredditManagement(CommandCog):
             )
             if alert_channel:
                 await self.create_or_update_alert_channel(context, subreddit, alert_channel)
-            self.restart_stream()
             embed = await self.generate_subreddit_embed(
                 "added", subreddit, channel, mod_role, mod_account, alert_channel
             )
@@ -249,7 +246,6 @@ class SubredditManagement(CommandCog):
                                     pass
                     embed = await self.generate_subreddit_embed("deleted", subreddit, result=result)
                     await context.send(embed=embed)
-                    self.restart_stream()
                 except Exception as error:
                     self.log.exception(error)
                     await self.error_embed(context, f"Failed to delete r/{subreddit}.")
@@ -354,13 +350,6 @@ class SubredditManagement(CommandCog):
                 alert_webhook.url,
             )
 
-    def restart_stream(self):
-        if not self.bot.debug:
-            try:
-                os.system("pm2 restart RedditModHelper-Stream")
-            except Exception as error:
-                self.log.exception(error)
-
     async def verify_valid_auth(self, context, mod_account, required_scopes):
         final_failed_message = "Authorization failed. Please try again or contact <@393801572858986496>."
         try:
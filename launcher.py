@@ -282,6 +282,83 @@ def drop(cog, quiet):
     run(remove_databases(pool, cog, quiet))
 
 
+@db.group(short_help="manages mirror.modlog's monthly partitions", options_metavar="[options]")
+def partitions():
+    pass
+
+
+def _modlog_sql():
+    from streams import ConnectionManager, connection_pool
+
+    return ConnectionManager(connection_pool)
+
+
+@partitions.command(name="init", short_help="partitions mirror.modlog by month")
+@click.option("--months-ahead", help="future partitions to create", default=3)
+def partitions_init(months_ahead):
+    """Converts mirror.modlog into a table partitioned by month.
+
+    The existing rows are kept as the mirror.modlog_legacy partition,
+    so nothing is copied. This locks mirror.modlog while the legacy
+    range is validated, stop the streamers and workers first.
+    """
+    from streams.partitions import partition_modlog
+
+    click.confirm("mirror.modlog will be locked while it's converted, continue?", abort=True)
+    try:
+        with _modlog_sql() as sql:
+            boundary = partition_modlog(sql, months_ahead)
+    except Exception:
+        click.echo(f"Could not partition mirror.modlog.\n{traceback.format_exc()}", err=True)
+        return
+    if boundary:
+        click.echo(f"Partitioned mirror.modlog, monthly partitions start at {boundary:%Y-%m}.")
+    else:
+        click.echo("mirror.modlog is already partitioned.")
+
+
+@partitions.command(name="create", short_help="creates future partitions")
+@click.option("--months-ahead", help="future partitions to create", default=3)
+def partitions_create(months_ahead):
+    """Creates any missing monthly partitions up to the given number of months ahead."""
+    from streams.partitions import ensure_partitions
+
+    with _modlog_sql() as sql:
+        through = ensure_partitions(sql, months_ahead=months_ahead)
+    click.echo(f"Partitions exist through {through:%Y-%m}.")
+
+
+@partitions.command(name="list", short_help="lists partitions")
+def partitions_list():
+    """Lists mirror.modlog's partitions with their ranges and sizes."""
+    from streams.partitions import list_partitions
+
+    with _modlog_sql() as sql:
+        for partition in list_partitions(sql):
+            click.echo(f"{partition.name:<20} {partition.size / 1024 ** 2:>12,.1f} MB  {partition.bounds}")
+
+
+@partitions.command(name="detach", short_help="detaches a month's partition")
+@click.argument("month", metavar="<YYYY-MM>")
+@click.option("--blocking", help="detach without CONCURRENTLY", is_flag=True)
+def partitions_detach(month, blocking):
+    """Detaches a month's partition from mirror.modlog.
+
+    The detached table keeps its rows and can be archived or dropped
+    without a vacuum on mirror.modlog.
+    """
+    from streams.partitions import detach_partition, parse_month
+
+    click.confirm(f"do you really want to detach {month}?", abort=True)
+    try:
+        with _modlog_sql() as sql:
+            name = detach_partition(sql, parse_month(month), concurrently=not blocking)
+    except Exception:
+        click.echo(f"Could not detach {month}.\n{traceback.format_exc()}", err=True)
+        return
+    click.echo(f"Detached mirror.{name}.")
+
+
 if __name__ == "__main__":
     try:
         main()
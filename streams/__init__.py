@@ -1,4 +1,5 @@
 import logging
+import threading
 from datetime import datetime, timezone
 
 from BotUtils import BotServices
@@ -17,10 +18,10 @@ from .utils import convert_or_none
 thingTypes = {"t1": "Comment", "t2": "Account", "t3": "Link", "t4": "Message", "t5": "Subreddit", "t6": "Award"}
 mapping = {
     "id": convert_or_none(lambda action_id: action_id.split("_")[1]),
-    "created_utc": convert_or_none(lambda created_utc: datetime.fromtimestamp(created_utc).astimezone(timezone.utc)),
+    "created_utc": convert_or_none(lambda created_utc: datetime.fromtimestamp(created_utc, timezone.utc)),
     "target_fullname": {
-        "target_type": convert_or_none(lambda target_fullname: thingTypes[target_fullname.split("_")[0]]),
-        "target_id": convert_or_none(lambda target_fullname: target_fullname.split("_")[1]),
+        "target_type": convert_or_none(lambda target_fullname: thingTypes[target_fullname.partition("_")[0]]),
+        "target_id": convert_or_none(lambda target_fullname: target_fullname.partition("_")[2]),
     },
     "_mod": "moderator",
     "action": "mod_action",
@@ -68,6 +69,16 @@ def setup_task_logger(logger, *args, **kwargs):
 
 
 cache = Client(["127.0.0.1"])
+_local = threading.local()
+
+
+def thread_cache():
+    # pylibmc clients aren't thread safe, so every thread that isn't the main one uses its own clone of ``cache``
+    client = getattr(_local, "cache", None)
+    if client is None:
+        client = _local.cache = cache.clone()
+    return client
+
 
 params = services._getDbConnectionSettings()
 url = f"postgresql://{params['user']}:{params['password']}@{params['host']}:{params['port']}/{params['database']}"
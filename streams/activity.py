@@ -0,0 +1,184 @@
+import logging
+import time
+from collections import Counter, defaultdict
+
+from . import log
+from .stream_config import (
+    alert_latency_interval,
+    alert_latency_target,
+    log_sample_limit,
+    log_sample_window,
+    log_summary_interval,
+    queue_delay_interval,
+    queue_delay_target,
+)
+
+
+def _percentile(samples, percentile):
+    return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+
+class LoggedAction:
+    """Renders an action for a log line only if the record is actually emitted."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        data = self.data
+        created = data["created_utc"].astimezone().strftime("%m-%d-%Y %I:%M:%S %p")
+        return f"{data['subreddit']} | {data['moderator']} | {data['mod_action']} | {created}"
+
+
+class ActionLog:
+    """Per-action logging for one stream with per-subreddit sampling and a periodic summary line.
+
+    :meth:`record` counts every action and only logs one while its subreddit is under ``sample_limit`` lines in the
+    current ``sample_window``. Admin actions are always logged. The summary of new, duplicate and admin counts and live
+    lag is logged every ``interval`` seconds from :meth:`record`, or from :meth:`report` for callers with their own
+    timer.
+    """
+
+    def __init__(
+        self, name, interval=log_summary_interval, sample_limit=log_sample_limit, sample_window=log_sample_window
+    ):
+        self.name = name
+        self.interval = interval
+        self.sample_limit = sample_limit
+        self.sample_window = sample_window
+        self.counts = Counter()
+        self.samples = {}
+        self.lag_total = 0
+        self.lag_max = 0
+        self.last_report = time.monotonic()
+
+    def _sampled(self, subreddit):
+        now = time.monotonic()
+        window_start, count = self.samples.get(subreddit, (now, 0))
+        if (now - window_start) >= self.sample_window:
+            window_start, count = now, 0
+        self.samples[subreddit] = (window_start, count + 1)
+        return count < self.sample_limit
+
+    def record(self, data, new, admin=False, stream=True, prefix=None):
+        if new:
+            self.counts["new" if stream else "backlog"] += 1
+        else:
+            self.counts["duplicate"] += 1
+        if admin:
+            self.counts["admin"] += 1
+        if stream and data["created_utc"] is not None:
+            lag = time.time() - data["created_utc"].timestamp()
+            self.counts["lagged"] += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+        level = logging.INFO if new or admin else logging.DEBUG
+        if log.isEnabledFor(level):
+            if admin or self._sampled(data["subreddit"]):
+                if prefix is None:
+                    prefix = "Ingesting" if new else "Already ingested"
+                log.log(level, "%s%s | %s", prefix, " | admin" if admin else "", LoggedAction(data))
+            else:
+                self.counts["sampled_out"] += 1
+        if (time.monotonic() - self.last_report) >= self.interval:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        if not self.counts:
+            return
+        lagged = self.counts.pop("lagged", 0)
+        counters = " | ".join(f"{key} {self.counts[key]:,}" for key in ["new", "backlog", "duplicate", "admin"])
+        lag = f"lag {self.lag_total / lagged:.1f}s (max {self.lag_max:.1f}s)" if lagged else "lag n/a"
+        sampled = f" | {self.counts['sampled_out']:,} lines sampled out" if self.counts["sampled_out"] else ""
+        log.info(f"{self.name} | {counters} | {lag}{sampled}")
+        self.counts.clear()
+        self.samples.clear()
+        self.lag_total = 0
+        self.lag_max = 0
+
+
+class AlertLatency:
+    """Percentiles of admin alert latency in an alert worker.
+
+    Every alert records when its action was created on Reddit, received by the streamer and sent to the webhook. Each
+    ``interval`` seconds the p50/p95/p99 of every stage is logged, with a warning when the end-to-end p95 is over
+    ``target`` seconds.
+    """
+
+    STAGES = ["reddit_to_streamer", "streamer_to_webhook", "end_to_end"]
+
+    def __init__(self, interval=alert_latency_interval, target=alert_latency_target):
+        self.interval = interval
+        self.target = target
+        self.samples = {stage: [] for stage in self.STAGES}
+        self.last_report = time.monotonic()
+
+    def record(self, created_utc, received, sent):
+        created = created_utc.timestamp()
+        if received is not None:
+            self.samples["reddit_to_streamer"].append(received - created)
+            self.samples["streamer_to_webhook"].append(sent - received)
+        self.samples["end_to_end"].append(sent - created)
+        if (time.monotonic() - self.last_report) >= self.interval:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        if not self.samples["end_to_end"]:
+            return
+        parts = []
+        for stage in self.STAGES:
+            samples = sorted(self.samples[stage])
+            if samples:
+                p50, p95, p99 = (_percentile(samples, percentile) for percentile in (50, 95, 99))
+                parts.append(f"{stage} p50 {p50:.1f}s p95 {p95:.1f}s p99 {p99:.1f}s")
+        count = len(self.samples["end_to_end"])
+        end_to_end_p95 = _percentile(sorted(self.samples["end_to_end"]), 95)
+        message = f"Admin alert latency ({count:,} alerts) | {' | '.join(parts)}"
+        if end_to_end_p95 > self.target:
+            log.warning(f"{message} | p95 over the {self.target}s target")
+        else:
+            log.info(message)
+        self.samples = {stage: [] for stage in self.STAGES}
+
+
+class QueueDelay:
+    """Per-subreddit queueing delay in an ingest worker, from a chunk being published to a worker picking it up.
+
+    Every ``interval`` seconds the overall p50/p95 and the ``top`` subreddits by p95 are logged, with a warning naming
+    the subreddits whose p95 is over ``target`` seconds.
+    """
+
+    def __init__(self, interval=queue_delay_interval, target=queue_delay_target, top=5):
+        self.interval = interval
+        self.target = target
+        self.top = top
+        self.samples = defaultdict(list)
+        self.last_report = time.monotonic()
+
+    def record(self, subreddit, delay):
+        self.samples[subreddit].append(delay)
+        if (time.monotonic() - self.last_report) >= self.interval:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        if not self.samples:
+            return
+        overall = sorted(delay for samples in self.samples.values() for delay in samples)
+        p95s = {subreddit: _percentile(sorted(samples), 95) for subreddit, samples in self.samples.items()}
+        slowest = sorted(p95s.items(), key=lambda item: item[1], reverse=True)
+        top = ", ".join(f"r/{subreddit} {p95:.1f}s" for subreddit, p95 in slowest[: self.top])
+        message = (
+            f"Queueing delay ({len(overall):,} chunks, {len(self.samples):,} subreddits) | "
+            f"p50 {_percentile(overall, 50):.1f}s p95 {_percentile(overall, 95):.1f}s | slowest p95 {top}"
+        )
+        starved = [subreddit for subreddit, p95 in slowest if p95 > self.target]
+        if starved:
+            log.warning(f"{message} | {len(starved):,} subreddits over the {self.target}s target")
+        else:
+            log.info(message)
+        self.samples.clear()
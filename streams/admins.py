@@ -0,0 +1,51 @@
+import time
+
+from . import log
+from .stream_config import admin_moderators, moderator_recheck_interval, moderator_refresh_interval
+
+
+class AdminClassifier:
+    """Tags live actions as admin locally so one unfiltered modlog stream can replace the ``mod=a``/``mod=-a`` pair.
+
+    A live action is an admin action when its moderator isn't on the subreddit's mod list. A moderator missing from
+    the cached list is checked against a freshly fetched one first, so newly added moderators aren't tagged, and no
+    action is tagged from a list that couldn't be fetched. The ``mod=a`` backlog pass in :class:`ModLogStreams` picks
+    up whatever this misses.
+    """
+
+    def __init__(self, reddit, subreddits):
+        self.reddit = reddit
+        self.subreddits = [subreddit.lower() for subreddit in subreddits]
+        self.moderators = {}
+        self.fetched = {}
+        self.last_refresh = 0
+
+    async def _fetch(self, subreddit):
+        self.fetched[subreddit] = time.time()
+        try:
+            sub = await self.reddit.subreddit(subreddit)
+            self.moderators[subreddit] = {str(moderator) for moderator in await sub.moderator()}
+        except Exception as error:
+            log.exception(error)
+            # a stale list would tag every moderator added since it was fetched
+            self.moderators.pop(subreddit, None)
+
+    async def refresh(self):
+        if (time.time() - self.last_refresh) < moderator_refresh_interval:
+            return
+        self.last_refresh = time.time()
+        for subreddit in self.subreddits:
+            await self._fetch(subreddit)
+
+    async def is_admin(self, moderator, subreddit, stream):
+        if moderator in admin_moderators:
+            return True
+        if not stream:
+            return False
+        subreddit = subreddit.lower()
+        moderators = self.moderators.get(subreddit)
+        if moderators is None or moderator not in moderators:
+            if (time.time() - self.fetched.get(subreddit, 0)) >= moderator_recheck_interval:
+                await self._fetch(subreddit)
+            moderators = self.moderators.get(subreddit)
+        return moderators is not None and moderator not in moderators
@@ -0,0 +1,320 @@
+"""Backfill the modlog history of many subreddits in parallel across every modlog account.
+
+Run with ``python -m streams.backfill [subreddit ...] [--accounts account ...]`` from the repository root. Without
+subreddits every registered subreddit that hasn't finished a backfill is walked, and without accounts every
+``modlog_account`` in use is.
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import asyncpraw
+import asyncprawcore
+from asyncpraw.endpoints import API_PATH
+from psycopg2.extras import execute_values
+
+from . import ConnectionManager, connection_pool, log, services
+from .batching import ChunkSizer
+from .cursors import CREATE_QUERY as CURSORS_CREATE_QUERY
+from .models import Subreddit
+from .pipeline import Publisher
+from .records import decode_listing
+from .retry import reddit as reddit_retry
+from .stream_config import backfill_max_failures, backfill_report_interval
+from .tasks import ingest_action_chunk
+
+CREATE_QUERY = """CREATE TABLE IF NOT EXISTS mirror.backfill_progress(
+                      subreddit TEXT PRIMARY KEY,
+                      head_id TEXT,
+                      head_created_utc TIMESTAMPTZ,
+                      after TEXT,
+                      pages INTEGER NOT NULL DEFAULT 0,
+                      actions BIGINT NOT NULL DEFAULT 0,
+                      started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                      updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                      completed_at TIMESTAMPTZ
+                  );
+                  """
+LOAD_QUERY = """SELECT subreddit, head_id, head_created_utc, after, pages, actions, completed_at
+                FROM mirror.backfill_progress WHERE subreddit=ANY(%s);
+                """
+SAVE_QUERY = """INSERT INTO mirror.backfill_progress(
+                    subreddit, head_id, head_created_utc, after, pages, actions, completed_at
+                ) VALUES %s
+                ON CONFLICT (subreddit) DO UPDATE SET head_id=EXCLUDED.head_id,
+                    head_created_utc=EXCLUDED.head_created_utc, after=EXCLUDED.after, pages=EXCLUDED.pages,
+                    actions=EXCLUDED.actions, completed_at=EXCLUDED.completed_at, updated_at=now();
+                """
+# a finished backfill becomes the streamers' backlog head, so their own walks stop where the backfill started
+HANDOFF_QUERY = """INSERT INTO mirror.stream_cursors(subreddit, mod_filter, head_id, head_created_utc) VALUES %s
+                   ON CONFLICT (subreddit, mod_filter) DO UPDATE SET head_id=EXCLUDED.head_id,
+                       head_created_utc=EXCLUDED.head_created_utc, updated_at=now()
+                   WHERE stream_cursors.head_created_utc IS NULL
+                       OR stream_cursors.head_created_utc < EXCLUDED.head_created_utc;
+                   """
+
+
+class SubredditBackfill:
+    __slots__ = (
+        "subreddit",
+        "accounts",
+        "head_id",
+        "head_created_utc",
+        "after",
+        "pages",
+        "actions",
+        "completed_at",
+        "in_flight",
+        "last_fetch",
+        "failures",
+        "failed",
+    )
+
+    def __init__(
+        self, subreddit, head_id=None, head_created_utc=None, after=None, pages=0, actions=0, completed_at=None
+    ):
+        self.subreddit = subreddit
+        # accounts that moderate the subreddit and can read its modlog
+        self.accounts = set()
+        # newest action when the backfill started, everything older is walked
+        self.head_id = head_id
+        self.head_created_utc = head_created_utc
+        self.after = after
+        self.pages = pages
+        self.actions = actions
+        self.completed_at = completed_at
+        self.in_flight = False
+        self.last_fetch = 0
+        # pages in a row that failed, the subreddit is skipped for the rest of the run once it's failed
+        self.failures = 0
+        self.failed = False
+
+    @property
+    def pending(self):
+        return self.completed_at is None and not self.failed and bool(self.accounts)
+
+    def as_row(self):
+        return (
+            self.subreddit,
+            self.head_id,
+            self.head_created_utc,
+            self.after,
+            self.pages,
+            self.actions,
+            self.completed_at,
+        )
+
+
+class BackfillStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.total = 0
+        self.window = Counter()
+
+    def record(self, account, actions):
+        self.total += actions
+        self.window[account] += actions
+
+    def report(self, states):
+        now = time.monotonic()
+        elapsed = max(now - self.last_report, 0.001)
+        completed = sum(1 for state in states if state.completed_at is not None)
+        failed = sum(1 for state in states if state.failed)
+        accounts = " | ".join(
+            f"u/{account} {actions / elapsed:,.1f}/s" for account, actions in sorted(self.window.items())
+        )
+        running = max(now - self.started, 0.001)
+        log.info(
+            f"Backfill | {completed:,}/{len(states):,} subreddits done, {failed:,} failed | "
+            f"{sum(self.window.values()) / elapsed:,.1f} actions/s | {self.total:,} actions in {running:,.0f}s "
+            f"({self.total / running:,.1f}/s)"
+            f"{' | ' + accounts if accounts else ''}"
+        )
+        self.last_report = now
+        self.window.clear()
+
+
+class Backfill:
+    """Walks the modlog history of ``subreddits`` with every account in ``accounts`` at once.
+
+    Pages are scheduled one at a time: an idle account takes the least recently fetched subreddit it moderates, fetches
+    one page and hands the subreddit back, so a large subreddit moves through whichever accounts are free while each
+    account keeps a single request in flight under its own rate limit. Progress is saved to
+    ``mirror.backfill_progress`` after each page is published and an interrupted backfill resumes from its last
+    cursor. Subreddits should be backfilled before they're added to a streamer, a streamer already walking one keeps
+    walking it on its own.
+    """
+
+    def __init__(self, subreddits, accounts, pool=connection_pool):
+        self.states = {subreddit.lower(): SubredditBackfill(subreddit.lower()) for subreddit in subreddits}
+        self.accounts = accounts
+        self.pool = pool
+        self.readers = {}
+        self.condition = asyncio.Condition()
+        self.publisher = Publisher(ingest_action_chunk, priority=0)
+        self.chunk_sizer = ChunkSizer()
+        self.stats = BackfillStats()
+
+    def _load(self):
+        with ConnectionManager(self.pool) as sql:
+            sql.execute(CREATE_QUERY)
+            sql.execute(CURSORS_CREATE_QUERY)
+            sql.execute(LOAD_QUERY, (list(self.states),))
+            for result in sql.fetchall():
+                self.states[result.subreddit] = SubredditBackfill(
+                    result.subreddit,
+                    result.head_id,
+                    result.head_created_utc,
+                    result.after,
+                    result.pages,
+                    result.actions,
+                    result.completed_at,
+                )
+        completed = [subreddit for subreddit, state in self.states.items() if state.completed_at is not None]
+        log.info(f"Loaded backfill progress for {len(self.states):,} subreddits ({len(completed):,} already done)")
+
+    def _save(self, row):
+        with ConnectionManager(self.pool) as sql:
+            execute_values(sql, SAVE_QUERY, [row])
+            subreddit, head_id, head_created_utc, _, _, _, completed_at = row
+            if completed_at is not None and head_id is not None:
+                execute_values(
+                    sql,
+                    HANDOFF_QUERY,
+                    [(subreddit, mod_filter, head_id, head_created_utc) for mod_filter in ["all", "a", "-a"]],
+                )
+                log.info(f"Backfill of r/{subreddit} complete")
+
+    async def _discover(self):
+        for account in self.accounts:
+            reddit = asyncpraw.Reddit(**services.reddit(account).config._settings, timeout=30)
+            try:
+                moderated = set()
+                async for subreddit in reddit.user.moderator_subreddits(limit=None):
+                    moderated.add(subreddit.display_name.lower())
+            except Exception as error:
+                log.exception(error)
+                await reddit.close()
+                continue
+            self.readers[account] = reddit
+            for subreddit in moderated & set(self.states):
+                self.states[subreddit].accounts.add(account)
+        for state in self.states.values():
+            if state.completed_at is None and not state.accounts:
+                log.warning(f"None of the backfill accounts moderate r/{state.subreddit}, skipping it")
+
+    def _next_for(self, account):
+        ready = [
+            state
+            for state in self.states.values()
+            if state.pending and not state.in_flight and account in state.accounts
+        ]
+        return min(ready, key=lambda state: state.last_fetch) if ready else None
+
+    def _has_work(self, account):
+        return any(state.pending and account in state.accounts for state in self.states.values())
+
+    async def _fetch_page(self, account, state):
+        params = {"limit": 100}
+        if state.after:
+            params["after"] = state.after
+        listing = await self.readers[account]._core.request(
+            "GET", API_PATH["about_log"].format(subreddit=state.subreddit), params=params
+        )
+        records, after = decode_listing(listing)
+        if state.head_id is None and records:
+            state.head_id = records[0]["id"]
+            state.head_created_utc = records[0]["created_utc"]
+        state.after = after
+        state.pages += 1
+        state.actions += len(records)
+        if not after:
+            state.completed_at = datetime.now(timezone.utc)
+        self.stats.record(account, len(records))
+        row = state.as_row()
+        # history is never tagged admin, so onboarding a subreddit doesn't alert on months-old admin actions
+        actions = [[data, False, False] for data in records]
+
+        async def on_published():
+            await asyncio.get_running_loop().run_in_executor(None, self._save, row)
+
+        await self.publisher.put(self.chunk_sizer.chunks(actions), on_published)
+
+    async def _worker(self, account):
+        failures = 0
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(
+                    lambda: self._next_for(account) is not None or not self._has_work(account)
+                )
+                state = self._next_for(account)
+                if state is None:
+                    return
+                state.in_flight = True
+            try:
+                await self._fetch_page(account, state)
+                failures = 0
+                state.failures = 0
+            except asyncprawcore.Forbidden:
+                log.warning(f"u/{account} can't read the modlog of r/{state.subreddit}")
+                state.accounts.discard(account)
+            except (asyncprawcore.NotFound, asyncprawcore.Redirect):
+                # banned, private-turned-deleted or misspelled subreddits won't come back during this run
+                log.warning(f"r/{state.subreddit} doesn't exist anymore, skipping it")
+                state.failed = True
+            except Exception as error:
+                log.exception(error)
+                failures += 1
+                state.failures += 1
+                if state.failures >= backfill_max_failures:
+                    log.error(f"Skipping r/{state.subreddit} after {state.failures:,} failed pages in a row")
+                    state.failed = True
+            finally:
+                async with self.condition:
+                    state.in_flight = False
+                    state.last_fetch = time.monotonic()
+                    self.condition.notify_all()
+            if failures:
+                await asyncio.sleep(reddit_retry(account).delay(failures))
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(backfill_report_interval)
+            self.stats.report(list(self.states.values()))
+            await asyncio.get_running_loop().run_in_executor(None, self.chunk_sizer.refresh)
+
+    async def run(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._load)
+        await self._discover()
+        background = [asyncio.create_task(self.publisher.run()), asyncio.create_task(self._report())]
+        try:
+            await asyncio.gather(*[self._worker(account) for account in self.readers])
+        finally:
+            await self.publisher.queue.join()
+            for task in background:
+                task.cancel()
+            self.publisher.close()
+            for reddit in self.readers.values():
+                await reddit.close()
+            self.stats.report(list(self.states.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("subreddits", nargs="*", help="subreddits to backfill, every registered one by default")
+    parser.add_argument("--accounts", nargs="+", help="accounts to read with, every modlog account by default")
+    args = parser.parse_args()
+    registered = Subreddit.query.all()
+    subreddits = args.subreddits or sorted({subreddit.name for subreddit in registered})
+    accounts = args.accounts or sorted(
+        {subreddit.modlog_account for subreddit in registered if subreddit.modlog_account}
+    )
+    log.info(f"Backfilling {len(subreddits):,} subreddits with {len(accounts):,} accounts")
+    asyncio.run(Backfill(subreddits, accounts).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pylibmc
+
+from . import cache, log, thread_cache
+from .routers import fair_queue
+from .stream_config import (
+    batch_max_latency,
+    batch_max_size,
+    chunk_max_size,
+    chunk_min_size,
+    ingest_latency_key,
+    target_chunk_seconds,
+)
+
+
+class ActionBatcher:
+    """Collects new actions and hands them to ``flush_callback`` by size, admin urgency or age.
+
+    The age limit is enforced by :meth:`run`, so a quiet subreddit's last actions are flushed within
+    ``max_latency`` seconds even if nothing else arrives. ``flush_callback`` is awaited right after the batch is taken,
+    so anything it does before its first ``await`` sees exactly the state the batch was cut at.
+    """
+
+    def __init__(self, flush_callback, max_size=batch_max_size, max_latency=batch_max_latency):
+        self.flush_callback = flush_callback
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self.pending = []
+        self.oldest = None
+
+    async def add(self, action, admin=False):
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.append(action)
+        if admin or len(self.pending) >= self.max_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        actions, self.pending, self.oldest = self.pending, [], None
+        await self.flush_callback(actions)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(min(1, self.max_latency / 2))
+            try:
+                if self.oldest is not None and (time.monotonic() - self.oldest) >= self.max_latency:
+                    await self.flush()
+            except Exception as error:
+                log.exception(error)
+
+
+class ChunkSizer:
+    """Sizes ingest_action_chunk tasks from the per-row insert latency the workers report."""
+
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+        self.last_refresh = 0
+        self.row_latency = None
+
+    def refresh(self):
+        # called from executor threads, so it reads through the thread's own client
+        if (time.time() - self.last_refresh) < self.refresh_interval:
+            return
+        self.last_refresh = time.time()
+        try:
+            self.row_latency = thread_cache().get(ingest_latency_key)
+        except pylibmc.Error:
+            pass
+
+    @property
+    def chunk_size(self):
+        if not self.row_latency:
+            return chunk_min_size
+        return max(chunk_min_size, min(chunk_max_size, int(target_chunk_seconds / self.row_latency)))
+
+    def chunks(self, actions):
+        # chunks never mix action_chunks buckets, so each one can go to its bucket's queue
+        size = self.chunk_size
+        buckets = {}
+        for action in actions:
+            buckets.setdefault(fair_queue(action[0]["subreddit"]), []).append(action)
+        return [bucket[x : x + size] for bucket in buckets.values() for x in range(0, len(bucket), size)]
+
+
+class LatencyReporter:
+    """Keeps a moving average of seconds per inserted row in a worker and publishes it for the streamers."""
+
+    def __init__(self, report_interval=10, smoothing=0.2):
+        self.report_interval = report_interval
+        self.smoothing = smoothing
+        self.last_report = 0
+        self.row_latency = None
+
+    def record(self, rows, seconds):
+        if not rows:
+            return
+        latency = seconds / rows
+        if self.row_latency is None:
+            self.row_latency = latency
+        else:
+            self.row_latency += self.smoothing * (latency - self.row_latency)
+        if (time.time() - self.last_report) >= self.report_interval:
+            self.last_report = time.time()
+            try:
+                cache.set(ingest_latency_key, self.row_latency)
+            except pylibmc.Error:
+                pass
@@ -0,0 +1,105 @@
+"""Microbenchmarks for the modlog parsing paths.
+
+Run with ``python -m streams.bench`` from the repository root.
+"""
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+from . import mapping, skip_keys
+from .records import decode_listing, map_action
+from .utils import map_values
+
+
+def generate_listing(size=100, seed=0):
+    random.seed(seed)
+    children = []
+    for i in range(size):
+        target = random.choice(["t1", "t3", "t2", None])
+        children.append(
+            {
+                "kind": "modaction",
+                "data": {
+                    "description": random.choice([None, "Rule 1"]),
+                    "target_body": "Lorem ipsum dolor sit amet " * random.randint(0, 20) or None,
+                    "mod_id36": "abc12",
+                    "created_utc": 1609459200.0 + i,
+                    "subreddit": "pics",
+                    "target_title": random.choice([None, "A title"]),
+                    "target_permalink": f"/r/pics/comments/abc{i}/" if target in ("t1", "t3") else None,
+                    "subreddit_name_prefixed": "r/pics",
+                    "details": random.choice(["remove", "spam", None]),
+                    "action": random.choice(["removecomment", "removelink", "approvelink", "banuser"]),
+                    "target_author": f"user{i}",
+                    "target_fullname": f"{target}_abc{i}" if target else None,
+                    "sr_id36": "2qh0u",
+                    "id": f"ModAction_{uuid.UUID(int=random.getrandbits(128))}",
+                    "mod": "SomeModerator",
+                },
+            }
+        )
+    return {"kind": "Listing", "data": {"after": "ModAction_last", "children": children}}
+
+
+def objectify_and_map(reddit, listing):
+    from asyncpraw.models import ModAction
+
+    return [
+        map_values(ModAction(reddit, _data=child["data"]).__dict__, mapping, skip_keys)
+        for child in listing["data"]["children"]
+    ]
+
+
+def decode_raw(listing):
+    return decode_listing(listing)[0]
+
+
+def measure(name, func, listing, pages):
+    start = time.perf_counter()
+    for _ in range(pages):
+        func(listing)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(listing)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    actions = pages * len(listing["data"]["children"])
+    print(f"{name:<24} {actions / elapsed:>12,.0f} actions/sec {peak / 1024:>10,.1f} KiB peak per page")
+    return actions / elapsed
+
+
+def bench_parsing(pages=500):
+    import asyncpraw
+
+    reddit = asyncpraw.Reddit(client_id="bench", client_secret="bench", user_agent="RedditModHelper bench")
+    listing = generate_listing()
+    objectified = measure("ModAction + map_values", lambda page: objectify_and_map(reddit, page), listing, pages)
+    raw = measure("raw JSON decode", decode_raw, listing, pages)
+    print(f"raw JSON decode is {raw / objectified:.1f}x faster")
+
+
+def bench_mapping(pages=500):
+    import asyncpraw
+    from asyncpraw.models import ModAction
+
+    reddit = asyncpraw.Reddit(client_id="bench", client_secret="bench", user_agent="RedditModHelper bench")
+    listing = generate_listing()
+    actions = [ModAction(reddit, _data=child["data"]).__dict__ for child in listing["data"]["children"]]
+    for action in actions:
+        expected = map_values(action, mapping, skip_keys)
+        record = map_action(action)
+        assert all(record.get(key) == value for key, value in expected.items() if key != "target_fullname")
+    before = measure(
+        "map_values", lambda page: [map_values(action, mapping, skip_keys) for action in actions], listing, pages
+    )
+    after = measure("map_action", lambda page: [map_action(action) for action in actions], listing, pages)
+    print(f"map_action is {after / before:.1f}x faster")
+
+
+BENCHMARKS = {"parsing": bench_parsing, "mapping": bench_mapping}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -1,10 +1,22 @@
 import sys
 
-accept_content = ["pickle"]
-result_serializer = "pickle"
-task_serializer = "pickle"
+from . import serialization  # noqa: F401 registers the modlog serializer
+from .routers import fair_queues
+from .stream_config import accept_pickle
+
+# pickle stays accepted until every producer sends modlog messages, then set STREAMS_ACCEPT_PICKLE=0
+accept_content = ["modlog", "json"] + (["pickle"] if accept_pickle else [])
+result_serializer = "json"
+task_serializer = "modlog"
 task_store_errors_even_if_ignored = False
 timezone = "US/Central"
 
 worker_redirect_stdouts = sys.platform != "darwin"
+# bulk workers prefetch deep and must not consume the admin queues. They consume every action_chunks.N bucket queue
+# and take from them round robin. The list follows stream_config.fair_queue_buckets, so start them with:
+#   celery -A streams.tasks worker -Q "$(python -c 'from streams.celery_config import bulk_queues; print(bulk_queues)')"
+bulk_queues = ",".join(["default", "actions", "action_chunks", *fair_queues(), "dead_letters"])
+# admin actions and their alerts get a small pool that takes one message at a time so an alert never waits behind a
+# prefetched backlog chunk:
+#   celery -A streams.tasks worker -Q admin_actions,admin_alerts -c 2 -O fair --prefetch-multiplier 1 -n admin@%h
 worker_prefetch_multiplier = 25
@@ -0,0 +1,190 @@
+from datetime import datetime, timezone
+
+from psycopg2.extras import execute_values
+
+from . import ConnectionManager, connection_pool, log
+
+CREATE_QUERY = """CREATE TABLE IF NOT EXISTS mirror.stream_cursors(
+                      subreddit TEXT NOT NULL,
+                      mod_filter TEXT NOT NULL,
+                      head_id TEXT,
+                      head_created_utc TIMESTAMPTZ,
+                      walk_top TIMESTAMPTZ,
+                      walk_after TEXT,
+                      updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                      PRIMARY KEY (subreddit, mod_filter)
+                  );
+                  """
+LOAD_QUERY = """SELECT subreddit, mod_filter, head_id, head_created_utc, walk_top, walk_after
+                FROM mirror.stream_cursors WHERE subreddit=ANY(%s);
+                """
+SAVE_QUERY = """INSERT INTO mirror.stream_cursors(
+                    subreddit, mod_filter, head_id, head_created_utc, walk_top, walk_after
+                ) VALUES %s
+                ON CONFLICT (subreddit, mod_filter) DO UPDATE SET
+                    head_id=EXCLUDED.head_id, head_created_utc=EXCLUDED.head_created_utc,
+                    walk_top=EXCLUDED.walk_top, walk_after=EXCLUDED.walk_after, updated_at=now();
+                """
+
+
+def _timestamp(value):
+    return value.timestamp() if value is not None else None
+
+
+def _datetime(value):
+    return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+
+
+class SubredditCursor:
+    """Backlog position for one subreddit and mod filter.
+
+    Every action created before ``head_created_utc`` has been ingested. While a walk is in progress, ``walk_top`` is
+    the newest action the walk started from and ``walk_after`` is the listing cursor of the last page it finished, so
+    everything between the two is ingested as well.
+    """
+
+    __slots__ = ("subreddit", "mod_filter", "head_id", "head_created_utc", "walk_top", "walk_after")
+
+    def __init__(self, subreddit, mod_filter, head_id=None, head_created_utc=None, walk_top=None, walk_after=None):
+        self.subreddit = subreddit
+        self.mod_filter = mod_filter
+        self.head_id = head_id
+        self.head_created_utc = head_created_utc
+        self.walk_top = walk_top
+        self.walk_after = walk_after
+
+    def as_row(self):
+        return (
+            self.subreddit,
+            self.mod_filter,
+            self.head_id,
+            _datetime(self.head_created_utc),
+            _datetime(self.walk_top),
+            self.walk_after,
+        )
+
+
+class BacklogWalk:
+    """Walks a multireddit modlog listing newest first until every subreddit reaches known territory.
+
+    An interrupted walk is resumed in two segments: from the top of the listing down to where the previous walk
+    started, then from the saved page cursor down to the old head.
+    """
+
+    def __init__(self, cursors):
+        self.cursors = {cursor.subreddit: cursor for cursor in cursors}
+        pending = [cursor for cursor in cursors if cursor.walk_after]
+        afters = {cursor.walk_after for cursor in pending}
+        self.resume_after = afters.pop() if len(afters) == 1 else None
+        self.resuming = {cursor.subreddit for cursor in pending} if self.resume_after else set()
+        self.walking = set(self.cursors) if not self.resuming else set()
+        self.segment = 0
+        self.stops = {}
+        self.done = set()
+        self.top = None
+        self.heads = {}
+
+    def segments(self):
+        self.stops = {
+            subreddit: cursor.walk_top if subreddit in self.resuming else cursor.head_created_utc
+            for subreddit, cursor in self.cursors.items()
+        }
+        self.done = set()
+        yield None
+        if self.resuming:
+            for subreddit in self.resuming:
+                cursor = self.cursors[subreddit]
+                cursor.walk_top = self.top or cursor.walk_top
+            self.stops = {subreddit: self.cursors[subreddit].head_created_utc for subreddit in self.resuming}
+            self.done = set(self.cursors) - self.resuming
+            self.walking = self.resuming
+            self.segment = 1
+            yield self.resume_after
+
+    @property
+    def finished(self):
+        return len(self.done) >= len(self.cursors)
+
+    def is_known(self, subreddit, action_id, created_utc):
+        subreddit = subreddit.lower()
+        cursor = self.cursors.get(subreddit)
+        if cursor is None:
+            return False
+        if self.top is None:
+            self.top = created_utc
+            for walking in self.walking:
+                self.cursors[walking].walk_top = created_utc
+        if subreddit in self.done:
+            return True
+        stop = self.stops.get(subreddit)
+        if stop is not None and created_utc < stop:
+            self.done.add(subreddit)
+            return True
+        if self.segment == 0:
+            self.heads.setdefault(subreddit, (action_id, created_utc))
+        return False
+
+    def advance(self, page_after):
+        for subreddit in self.walking:
+            self.cursors[subreddit].walk_after = page_after
+
+    def finish(self):
+        for subreddit, cursor in self.cursors.items():
+            head_id, head_created_utc = self.heads.get(subreddit, (cursor.head_id, self.top or cursor.walk_top))
+            if head_created_utc is not None:
+                cursor.head_id = head_id
+                cursor.head_created_utc = head_created_utc
+            cursor.walk_top = None
+            cursor.walk_after = None
+
+
+class BacklogCursors:
+    def __init__(self, subreddits, mod_filters, pool=connection_pool):
+        self.subreddits = [subreddit.lower() for subreddit in subreddits]
+        self.pool = pool
+        self.cursors = {
+            (subreddit, mod_filter): SubredditCursor(subreddit, mod_filter)
+            for subreddit in self.subreddits
+            for mod_filter in mod_filters
+        }
+
+    def load(self):
+        with ConnectionManager(self.pool) as sql:
+            sql.execute(CREATE_QUERY)
+            sql.execute(LOAD_QUERY, (self.subreddits,))
+            filtered_heads = {}
+            for result in sql.fetchall():
+                key = (result.subreddit, result.mod_filter)
+                if key in self.cursors:
+                    self.cursors[key] = SubredditCursor(
+                        result.subreddit,
+                        result.mod_filter,
+                        result.head_id,
+                        _timestamp(result.head_created_utc),
+                        _timestamp(result.walk_top),
+                        result.walk_after,
+                    )
+                if result.mod_filter in ("a", "-a"):
+                    filtered_heads.setdefault(result.subreddit, []).append(result.head_created_utc)
+        # unfiltered walks start from the older of the admin and non-admin heads when only those exist
+        for (subreddit, mod_filter), cursor in self.cursors.items():
+            heads = filtered_heads.get(subreddit, [])
+            if mod_filter == "all" and cursor.head_created_utc is None and len(heads) == 2 and None not in heads:
+                cursor.head_created_utc = _timestamp(min(heads))
+        log.info(f"Loaded backlog cursors for {len(self.subreddits):,} subreddits")
+
+    def walk(self, mod_filter):
+        return BacklogWalk(
+            [cursor for (_, cursor_filter), cursor in self.cursors.items() if cursor_filter == mod_filter]
+        )
+
+    def snapshot(self):
+        return [cursor.as_row() for cursor in self.cursors.values()]
+
+    def save(self, rows):
+        with ConnectionManager(self.pool) as sql:
+            execute_values(sql, SAVE_QUERY, rows)
+        log.debug(f"Checkpointed {len(rows):,} backlog cursors")
+
+    def checkpoint(self):
+        self.save(self.snapshot())
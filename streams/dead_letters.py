@@ -0,0 +1,195 @@
+"""Failure classification, retry scheduling and dead letters for the ingest tasks.
+
+Inspect and replay dead letters with ``python -m streams.dead_letters`` from the repository root::
+
+    python -m streams.dead_letters list --kind data
+    python -m streams.dead_letters show 42
+    python -m streams.dead_letters replay --kind transient
+    python -m streams.dead_letters purge --days 30
+"""
+import argparse
+import random
+import re
+
+import psycopg2
+import pylibmc
+from kombu.exceptions import OperationalError as BrokerError
+from psycopg2.pool import PoolError
+
+from . import ConnectionManager, connection_pool, log
+from .serialization import dumps, loads
+from .stream_config import ingest_retry_base, ingest_retry_max
+
+CREATE_QUERY = """CREATE TABLE IF NOT EXISTS mirror.ingest_dead_letters(
+                      id BIGSERIAL PRIMARY KEY,
+                      task TEXT NOT NULL,
+                      payload BYTEA NOT NULL,
+                      actions INTEGER NOT NULL,
+                      failure_kind TEXT NOT NULL,
+                      error TEXT NOT NULL,
+                      attempts INTEGER NOT NULL,
+                      failed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                      replayed_at TIMESTAMPTZ
+                  );
+                  """
+INSERT_QUERY = """INSERT INTO mirror.ingest_dead_letters(task, payload, actions, failure_kind, error, attempts)
+                  VALUES (%s, %s, %s, %s, %s, %s) RETURNING id;
+                  """
+LIST_QUERY = """SELECT id, task, actions, failure_kind, error, attempts, failed_at, replayed_at
+                FROM mirror.ingest_dead_letters
+                WHERE (%(kind)s IS NULL OR failure_kind=%(kind)s) AND (%(replayed)s OR replayed_at IS NULL)
+                ORDER BY id LIMIT %(limit)s;
+                """
+REPLAY_QUERY = """SELECT id, task, payload FROM mirror.ingest_dead_letters
+                  WHERE replayed_at IS NULL AND (%(ids)s IS NULL OR id=ANY(%(ids)s))
+                  AND (%(kind)s IS NULL OR failure_kind=%(kind)s) AND id > %(after)s ORDER BY id LIMIT %(limit)s;
+                  """
+MARK_REPLAYED_QUERY = "UPDATE mirror.ingest_dead_letters SET replayed_at=now() WHERE id=ANY(%s);"
+PURGE_QUERY = "DELETE FROM mirror.ingest_dead_letters WHERE replayed_at < now() - make_interval(days => %s);"
+
+TRANSIENT = "transient"  # the database, cache or broker is unavailable, retrying later will work
+DATA = "data"  # something in the batch can't be written, splitting the batch isolates it
+PERMANENT = "permanent"  # the write itself is broken (schema or code), nothing succeeds until it's fixed
+
+_TRANSIENT_ERRORS = (
+    psycopg2.OperationalError,
+    psycopg2.InterfaceError,
+    PoolError,
+    pylibmc.Error,
+    BrokerError,
+    ConnectionError,
+    TimeoutError,
+)
+_DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, KeyError, TypeError, ValueError, AttributeError)
+_PERMANENT_ERRORS = (psycopg2.ProgrammingError, psycopg2.NotSupportedError)
+# the writers create partitions ahead of time, a row with nowhere to go means that raced and will succeed on retry
+_MISSING_PARTITION = re.compile(r"no partition of relation .* found for row")
+
+
+def classify(error):
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return TRANSIENT
+    if isinstance(error, psycopg2.IntegrityError) and _MISSING_PARTITION.search(str(error)):
+        return TRANSIENT
+    if isinstance(error, _DATA_ERRORS):
+        return DATA
+    if isinstance(error, _PERMANENT_ERRORS):
+        return PERMANENT
+    return TRANSIENT
+
+
+def retry_countdown(retries):
+    countdown = min(ingest_retry_max, ingest_retry_base * 2**retries)
+    return countdown / 2 + random.uniform(0, countdown / 2)
+
+
+def store(task, args, kwargs, kind, error, attempts):
+    """Write a dead letter and return its id."""
+    actions = args[0]
+    count = len(actions) if isinstance(actions, list) and actions and isinstance(actions[0], list) else 1
+    payload = dumps({"args": list(args), "kwargs": kwargs})
+    with ConnectionManager(connection_pool) as sql:
+        sql.execute(CREATE_QUERY)
+        sql.execute(INSERT_QUERY, (task, psycopg2.Binary(payload), count, kind, error, attempts))
+        return sql.fetchone().id
+
+
+def list_dead_letters(kind=None, replayed=False, limit=50):
+    with ConnectionManager(connection_pool) as sql:
+        sql.execute(CREATE_QUERY)
+        sql.execute(LIST_QUERY, {"kind": kind, "replayed": replayed, "limit": limit})
+        return sql.fetchall()
+
+
+def get_dead_letter(dead_letter_id):
+    with ConnectionManager(connection_pool) as sql:
+        sql.execute("SELECT * FROM mirror.ingest_dead_letters WHERE id=%s;", (dead_letter_id,))
+        result = sql.fetchone()
+    if result is None:
+        return None, None
+    return result, loads(bytes(result.payload))
+
+
+def replay(ids=None, kind=None, batch_size=500):
+    """Requeue pending dead letters through the normal routing and mark them replayed. Returns how many were sent."""
+    from .tasks import app
+
+    replayed = 0
+    after = 0
+    while True:
+        with ConnectionManager(connection_pool) as sql:
+            sql.execute(REPLAY_QUERY, {"ids": ids, "kind": kind, "after": after, "limit": batch_size})
+            results = sql.fetchall()
+            if not results:
+                return replayed
+            sent = []
+            for result in results:
+                body = loads(bytes(result.payload))
+                kwargs = body["kwargs"]
+                if "queued" in kwargs:
+                    # the replay wasn't queued by a publisher, keep its age out of the queueing delay
+                    kwargs = {**kwargs, "queued": None}
+                try:
+                    app.tasks[result.task].apply_async(args=body["args"], kwargs=kwargs)
+                except Exception as error:
+                    log.exception(error)
+                    continue
+                sent.append(result.id)
+            sql.execute(MARK_REPLAYED_QUERY, (sent,))
+        replayed += len(sent)
+        after = results[-1].id
+        log.info(f"Replayed {replayed:,} dead letters")
+
+
+def purge(days):
+    with ConnectionManager(connection_pool) as sql:
+        sql.execute(PURGE_QUERY, (days,))
+        return sql.rowcount
+
+
+def main():
+    from .activity import LoggedAction
+
+    parser = argparse.ArgumentParser(description="Inspect and replay ingest dead letters.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="list dead letters")
+    list_parser.add_argument("--kind", choices=[TRANSIENT, DATA, PERMANENT])
+    list_parser.add_argument("--replayed", action="store_true", help="include replayed dead letters")
+    list_parser.add_argument("--limit", type=int, default=50)
+    show_parser = commands.add_parser("show", help="show a dead letter's error and actions")
+    show_parser.add_argument("id", type=int)
+    replay_parser = commands.add_parser("replay", help="requeue pending dead letters")
+    replay_parser.add_argument("ids", type=int, nargs="*", help="dead letters to replay, every pending one by default")
+    replay_parser.add_argument("--kind", choices=[TRANSIENT, DATA, PERMANENT])
+    purge_parser = commands.add_parser("purge", help="delete dead letters replayed more than --days ago")
+    purge_parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for result in list_dead_letters(args.kind, args.replayed, args.limit):
+            error = result.error.splitlines()[0][:80] if result.error else ""
+            status = f"replayed {result.replayed_at:%Y-%m-%d %H:%M}" if result.replayed_at else "pending"
+            print(
+                f"{result.id:>8} {result.failed_at:%Y-%m-%d %H:%M} {result.task.rsplit('.', 1)[-1]:<20} "
+                f"{result.actions:>5} {result.failure_kind:<10} {result.attempts:>3} {status:<26} {error}"
+            )
+    elif args.command == "show":
+        result, body = get_dead_letter(args.id)
+        if result is None:
+            parser.exit(1, f"No dead letter {args.id}\n")
+        print(f"{result.task} | {result.failure_kind} after {result.attempts} attempts | failed {result.failed_at}")
+        print(result.error)
+        actions = body["args"][0]
+        if body["args"] and isinstance(actions, list):
+            for data, admin, _ in actions:
+                print(f"  {LoggedAction(data)}{' | admin' if admin else ''}")
+        else:
+            print(f"  {LoggedAction(actions)}")
+    elif args.command == "replay":
+        print(f"Replayed {replay(args.ids or None, args.kind):,} dead letters")
+    elif args.command == "purge":
+        print(f"Purged {purge(args.days):,} dead letters")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Spreads the streamed subreddits over every running streamer with leases in Postgres.
+
+Subreddits hash into ``stream_shards`` fixed shards. Every node heartbeats into ``mirror.stream_nodes`` and places
+the shards on a consistent hash ring of the live nodes, so a node joining or leaving only moves the shards next to it
+on the ring. A node streams a shard only while it holds the shard's lease in ``mirror.stream_leases``. Leases are
+renewed every ``stream_lease_renew_interval`` seconds and can be taken over once they're ``stream_lease_ttl`` seconds
+old, so a dead node's shards move to the nodes the ring now gives them to.
+"""
+import asyncio
+import bisect
+import hashlib
+import time
+
+from . import ConnectionManager, connection_pool, log
+from .stream_config import stream_lease_renew_interval, stream_lease_ttl, stream_node, stream_shards
+
+CREATE_QUERIES = [
+    """CREATE TABLE IF NOT EXISTS mirror.stream_nodes(
+           node TEXT PRIMARY KEY,
+           heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT now()
+       );
+       """,
+    """CREATE TABLE IF NOT EXISTS mirror.stream_leases(
+           shard INT PRIMARY KEY,
+           node TEXT NOT NULL,
+           expires_at TIMESTAMPTZ NOT NULL
+       );
+       """,
+]
+HEARTBEAT_QUERY = (
+    "INSERT INTO mirror.stream_nodes(node) VALUES (%s) ON CONFLICT (node) DO UPDATE SET heartbeat_at=now();"
+)
+LIVE_NODES_QUERY = "SELECT node FROM mirror.stream_nodes WHERE heartbeat_at > now() - make_interval(secs => %s);"
+ACQUIRE_QUERY = """INSERT INTO mirror.stream_leases(shard, node, expires_at)
+                   SELECT shard, %(node)s, now() + make_interval(secs => %(ttl)s)
+                   FROM unnest(%(shards)s::INT[]) AS shard
+                   ON CONFLICT (shard) DO UPDATE SET node=EXCLUDED.node, expires_at=EXCLUDED.expires_at
+                   WHERE stream_leases.node=EXCLUDED.node OR stream_leases.expires_at < now()
+                   RETURNING shard;
+                   """
+RELEASE_QUERY = "DELETE FROM mirror.stream_leases WHERE node=%s AND shard=ANY(%s);"
+LEAVE_QUERY = "DELETE FROM mirror.stream_nodes WHERE node=%s;"
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def shard_of(subreddit, shards=stream_shards):
+    return _hash(subreddit.lower()) % shards
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes=256):
+        self.points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self.keys = [point for point, _ in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        return self.points[bisect.bisect(self.keys, _hash(key)) % len(self.points)][1]
+
+
+class ShardLeases:
+    """This node's stream shards.
+
+    :meth:`run` calls ``on_change`` (without awaiting it) whenever :attr:`owned` changes. Shards the ring moves to
+    another node keep being renewed until that call finishes, so their streams are drained before the lease is let go.
+    If the leases can't be renewed for ``ttl - renew_interval`` seconds every shard is dropped, before another node
+    could take them over.
+    """
+
+    def __init__(
+        self,
+        node=stream_node,
+        shards=stream_shards,
+        ttl=stream_lease_ttl,
+        renew_interval=stream_lease_renew_interval,
+        pool=connection_pool,
+    ):
+        self.node = node
+        self.shards = shards
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.pool = pool
+        # shards this node streams, and every shard it holds a lease on (owned plus the ones being handed off)
+        self.owned = set()
+        self.held = set()
+        self.last_renewed = time.monotonic()
+        self.change = None
+
+    def owns(self, subreddit):
+        return shard_of(subreddit, self.shards) in self.owned
+
+    def _create(self):
+        with ConnectionManager(self.pool) as sql:
+            for query in CREATE_QUERIES:
+                sql.execute(query)
+
+    def _renew(self):
+        with ConnectionManager(self.pool) as sql:
+            sql.execute(HEARTBEAT_QUERY, (self.node,))
+            sql.execute(LIVE_NODES_QUERY, (self.ttl,))
+            ring = HashRing([result.node for result in sql.fetchall()])
+            wanted = {shard for shard in range(self.shards) if ring.owner(f"shard-{shard}") == self.node}
+            sql.execute(ACQUIRE_QUERY, {"node": self.node, "ttl": self.ttl, "shards": sorted(wanted | self.held)})
+            held = {result.shard for result in sql.fetchall()}
+        return wanted, held
+
+    def _release(self, shards):
+        with ConnectionManager(self.pool) as sql:
+            sql.execute(RELEASE_QUERY, (self.node, sorted(shards)))
+
+    def _leave(self):
+        with ConnectionManager(self.pool) as sql:
+            sql.execute(RELEASE_QUERY, (self.node, sorted(self.held)))
+            sql.execute(LEAVE_QUERY, (self.node,))
+
+    def _set_owned(self, owned, on_change):
+        if owned != self.owned:
+            log.info(f"Node {self.node} owns {len(owned):,}/{self.shards:,} shards (was {len(self.owned):,})")
+            self.owned = owned
+            self.change = asyncio.ensure_future(on_change())
+
+    async def run(self, on_change):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._create)
+        try:
+            while True:
+                try:
+                    wanted, self.held = await loop.run_in_executor(None, self._renew)
+                    self.last_renewed = time.monotonic()
+                    self._set_owned(self.held & wanted, on_change)
+                    handed_off = self.held - wanted
+                    if handed_off and (self.change is None or self.change.done()):
+                        await loop.run_in_executor(None, self._release, handed_off)
+                        self.held -= handed_off
+                except Exception as error:
+                    log.exception(error)
+                    if (time.monotonic() - self.last_renewed) > (self.ttl - self.renew_interval):
+                        log.warning(f"Node {self.node} couldn't renew its leases, stopping its streams")
+                        self._set_owned(set(), on_change)
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            self.owned = set()
+            try:
+                self._leave()
+            except Exception as error:
+                log.exception(error)
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asyncpraw.endpoints import API_PATH
+
+from .records import decode_listing
+
+
+class RawModlogListing:
+    """Async modlog listing that skips asyncpraw's objector.
+
+    Pages are requested straight through ``reddit._core`` and decoded into :class:`.ActionRecord` instances. Like
+    asyncpraw's ``ListingGenerator``, ``params["after"]`` holds the cursor of the next page to fetch.
+    """
+
+    def __init__(self, reddit, subreddit, limit=None, params=None):
+        self.reddit = reddit
+        self.url = API_PATH["about_log"].format(subreddit=subreddit)
+        self.limit = limit
+        self.params = dict(params or {})
+        self.params["limit"] = min(limit, 100) if limit else 100
+        self.yielded = 0
+        self._records = []
+        self._index = 0
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    async def _next_page(self):
+        if self._exhausted:
+            raise StopAsyncIteration()
+        listing = await self.reddit._core.request("GET", self.url, params=self.params)
+        self._records, after = decode_listing(listing)
+        self._index = 0
+        self.params["after"] = after
+        if not after:
+            self._exhausted = True
+
+    async def __anext__(self):
+        if self.limit is not None and self.yielded >= self.limit:
+            raise StopAsyncIteration()
+        while self._index >= len(self._records):
+            await self._next_page()
+        self._index += 1
+        self.yielded += 1
+        return self._records[self._index - 1]
+
+
+class ModlogPage(list):
+    """One listing page of :class:`.ActionRecord` instances.
+
+    ``before`` is the cursor the page was requested with and ``after`` the cursor of the page following it, which is
+    ``None`` on the last page.
+    """
+
+    def __init__(self, records, before, after):
+        super().__init__(records)
+        self.before = before
+        self.after = after
+
+
+class ChunkGenerator:
+    """Sync modlog listing that yields whole :class:`ModlogPage` pages instead of single actions.
+
+    Pages are requested through ``reddit._core`` and decoded like :class:`RawModlogListing`. Passing ``params["after"]``
+    resumes from a stored cursor, and ``params["after"]`` always holds the cursor of the next page to be yielded. With
+    ``prefetch`` the next page is requested on a background thread while the caller works through the current one.
+    """
+
+    def __init__(self, reddit, url, limit=None, params=None, prefetch=False):
+        self.reddit = reddit
+        self.url = url
+        self.limit = limit
+        self.params = dict(params or {})
+        self.params["limit"] = min(limit, 100) if limit else 100
+        self.yielded = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") if prefetch else None
+        self._pending = None
+        self._exhausted = False
+
+    def __iter__(self):
+        return self
+
+    def _fetch(self, after):
+        params = dict(self.params)
+        params.pop("after", None)
+        if after:
+            params["after"] = after
+        records, next_after = decode_listing(self.reddit._core.request("GET", self.url, params=params))
+        return ModlogPage(records, after, next_after)
+
+    def __next__(self):
+        if self._exhausted or (self.limit is not None and self.yielded >= self.limit):
+            self.close()
+            raise StopIteration()
+        if self._pending is not None:
+            page, self._pending = self._pending.result(), None
+        else:
+            page = self._fetch(self.params.get("after"))
+        self.params["after"] = page.after
+        if not page.after:
+            self._exhausted = True
+        elif self._executor is not None:
+            self._pending = self._executor.submit(self._fetch, page.after)
+        if self.limit is not None and self.yielded + len(page) > self.limit:
+            del page[self.limit - self.yielded :]
+        self.yielded += len(page)
+        if not page and self._exhausted:
+            self.close()
+            raise StopIteration()
+        return page
+
+    def close(self):
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,157 @@
+"""Monthly range partitioning of ``mirror.modlog`` on ``created_utc``.
+
+Each month lives in ``mirror.modlog_YYYY_MM`` covering ``[first of the month, first of the next month)`` in UTC. The
+rows that existed before partitioning stay in ``mirror.modlog_legacy``, attached for everything older than the first
+monthly partition, so converting the table doesn't rewrite it.
+"""
+import re
+from datetime import datetime, timezone
+
+from . import log
+from .stream_config import partition_months_ahead
+
+IS_PARTITIONED_QUERY = """SELECT c.relkind = 'p' AS partitioned FROM pg_class c
+                          JOIN pg_namespace n ON n.oid=c.relnamespace
+                          WHERE n.nspname='mirror' AND c.relname='modlog';
+                          """
+LIST_QUERY = """SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bounds,
+                    pg_total_relation_size(child.oid) AS size
+                FROM pg_inherits
+                JOIN pg_class child ON child.oid=pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent='mirror.modlog'::regclass
+                ORDER BY child.relname;
+                """
+CREATE_PARTITION_QUERY = (
+    "CREATE TABLE IF NOT EXISTS mirror.{name} PARTITION OF mirror.modlog FOR VALUES FROM (%s) TO (%s);"
+)
+DETACH_PARTITION_QUERY = "ALTER TABLE mirror.modlog DETACH PARTITION mirror.{name}{concurrently};"
+CONVERT_QUERIES = [
+    "ALTER TABLE mirror.modlog RENAME TO modlog_legacy;",
+    "CREATE TABLE mirror.modlog (LIKE mirror.modlog_legacy INCLUDING ALL) PARTITION BY RANGE (created_utc);",
+]
+ATTACH_LEGACY_QUERY = (
+    "ALTER TABLE mirror.modlog ATTACH PARTITION mirror.modlog_legacy FOR VALUES FROM (MINVALUE) TO (%s);"
+)
+MAX_CREATED_QUERY = "SELECT max(created_utc) AS latest FROM mirror.modlog;"
+# serializes partition creation between workers, a racing CREATE TABLE IF NOT EXISTS ... PARTITION OF can still fail
+# with a unique violation on the catalog, which would be dead-lettered as bad data
+PARTITION_LOCK_QUERY = "SELECT pg_advisory_xact_lock(hashtext('mirror.modlog partitions'));"
+MONTHLY_NAME = re.compile(r"modlog_\d{4}_\d{2}")
+
+
+def month_start(value):
+    value = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f"modlog_{month:%Y_%m}"
+
+
+def parse_month(value):
+    """Parse ``YYYY-MM`` into the first of that month in UTC."""
+    return datetime.strptime(value, "%Y-%m").replace(tzinfo=timezone.utc)
+
+
+def is_partitioned(sql):
+    sql.execute(IS_PARTITIONED_QUERY)
+    result = sql.fetchone()
+    return bool(result and result.partitioned)
+
+
+def list_partitions(sql):
+    sql.execute(LIST_QUERY)
+    return sql.fetchall()
+
+
+def ensure_partitions(sql, latest=None, months_ahead=partition_months_ahead):
+    """Create any missing monthly partitions from the first one through ``months_ahead`` months after ``latest``.
+
+    Returns the exclusive upper bound of the partitions that now exist.
+    """
+    now = datetime.now(timezone.utc)
+    latest = max(latest, now) if latest else now
+    sql.execute("BEGIN;")
+    try:
+        sql.execute(PARTITION_LOCK_QUERY)
+        existing = {partition.name for partition in list_partitions(sql)}
+        monthly = [parse_month(name[7:].replace("_", "-")) for name in existing if MONTHLY_NAME.fullmatch(name)]
+        # months before the first monthly partition belong to the legacy partition, every month after it up to
+        # ``through`` gets one, including months a stale horizon skipped
+        month = min(monthly) if monthly else month_start(now)
+        through = add_months(month_start(latest), months_ahead + 1)
+        created = []
+        while month < through:
+            name = partition_name(month)
+            if name not in existing:
+                sql.execute(CREATE_PARTITION_QUERY.format(name=name), (month, add_months(month, 1)))
+                created.append(name)
+            month = add_months(month, 1)
+        sql.execute("COMMIT;")
+    except Exception:
+        sql.execute("ROLLBACK;")
+        raise
+    for name in created:
+        log.info(f"Created partition mirror.{name}")
+    return through
+
+
+def partition_modlog(sql, months_ahead=partition_months_ahead):
+    """Convert ``mirror.modlog`` into a partitioned table, keeping the existing rows as ``mirror.modlog_legacy``.
+
+    The legacy partition covers everything before the month after the newest existing action, monthly partitions
+    start there. Attaching it scans the old table once to validate the range but doesn't copy any rows.
+    """
+    if is_partitioned(sql):
+        log.info("mirror.modlog is already partitioned")
+        return None
+    sql.execute("BEGIN;")
+    try:
+        sql.execute("LOCK TABLE mirror.modlog IN ACCESS EXCLUSIVE MODE;")
+        sql.execute(MAX_CREATED_QUERY)
+        latest = sql.fetchone().latest or datetime.now(timezone.utc)
+        boundary = add_months(month_start(max(latest, datetime.now(timezone.utc))), 1)
+        for query in CONVERT_QUERIES:
+            sql.execute(query)
+        sql.execute(ATTACH_LEGACY_QUERY, (boundary,))
+        month = boundary
+        through = add_months(boundary, months_ahead)
+        while month < through:
+            sql.execute(CREATE_PARTITION_QUERY.format(name=partition_name(month)), (month, add_months(month, 1)))
+            month = add_months(month, 1)
+        sql.execute("COMMIT;")
+    except Exception:
+        sql.execute("ROLLBACK;")
+        raise
+    log.info(f"Partitioned mirror.modlog, rows before {boundary:%Y-%m-%d} are in mirror.modlog_legacy")
+    return boundary
+
+
+def detach_partition(sql, month, concurrently=True):
+    name = partition_name(month)
+    sql.execute(DETACH_PARTITION_QUERY.format(name=name, concurrently=" CONCURRENTLY" if concurrently else ""))
+    log.info(f"Detached mirror.{name}")
+    return name
+
+
+class PartitionHorizon:
+    """Remembers how far ahead partitions exist so writers only create them when a batch gets close to the edge."""
+
+    def __init__(self, months_ahead=partition_months_ahead):
+        self.months_ahead = months_ahead
+        self.partitioned = None
+        self.through = None
+
+    def ensure(self, sql, latest):
+        if self.partitioned is None:
+            self.partitioned = is_partitioned(sql)
+        if not self.partitioned:
+            return
+        if self.through is not None and add_months(month_start(latest), 1) < self.through:
+            return
+        self.through = ensure_partitions(sql, latest, self.months_ahead)
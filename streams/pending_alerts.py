@@ -0,0 +1,96 @@
+"""Admin alerts waiting to be sent, kept in ``mirror.pending_alerts`` so the coalescing window survives restarts.
+
+The ingest tasks claim their admin actions by marking them pinged, so an action the ``mod=a`` pass sends again while
+its alert is still on its way isn't alerted twice, then queue them here per webhook and schedule a flush of the webhook
+``alert_coalesce_window`` seconds later. The first flush to run takes everything queued for the webhook by then, so a
+sweep spread over many ingest tasks goes out as a few messages. A flush holds its rows locked until it commits and
+only deletes the ones that were delivered, so alerts in a flush that dies with its worker are picked up by the next.
+"""
+from psycopg2.extras import execute_values
+
+from .records import COLUMNS
+
+CREATE_QUERY = """CREATE TABLE IF NOT EXISTS mirror.pending_alerts(
+                      webhook TEXT NOT NULL,
+                      id TEXT NOT NULL,
+                      created_utc TIMESTAMPTZ NOT NULL,
+                      received DOUBLE PRECISION,
+                      queued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                      PRIMARY KEY (webhook, id, created_utc)
+                  );
+                  """
+QUEUE_QUERY = """INSERT INTO mirror.pending_alerts(webhook, id, created_utc, received) VALUES %s
+                 ON CONFLICT (webhook, id, created_utc) DO NOTHING;
+                 """
+TAKE_QUERY = f"""SELECT pending.received, {", ".join(f"modlog.{column}" for column in COLUMNS)}
+                  FROM mirror.pending_alerts pending
+                  JOIN mirror.modlog modlog ON modlog.id=pending.id AND modlog.created_utc=pending.created_utc
+                  WHERE pending.webhook=%s
+                  ORDER BY pending.created_utc, pending.id
+                  FOR UPDATE OF pending SKIP LOCKED;
+                  """
+CLAIM_ACTIONS_QUERY = """UPDATE mirror.modlog SET pinged=true
+                         WHERE id=ANY(%s) AND created_utc=ANY(%s) AND NOT pinged RETURNING id;
+                         """
+# a rejected alert releases its action unless another webhook's alert for it is still waiting
+RELEASE_QUERY = """UPDATE mirror.modlog modlog SET pinged=false WHERE id=ANY(%s) AND created_utc=ANY(%s)
+                   AND NOT EXISTS (SELECT FROM mirror.pending_alerts pending
+                                   WHERE pending.id=modlog.id AND pending.created_utc=modlog.created_utc);
+                   """
+REMOVE_QUERY = "DELETE FROM mirror.pending_alerts WHERE webhook=%s AND id=ANY(%s) AND created_utc=ANY(%s);"
+
+_created = False
+
+
+def _ids(actions):
+    return [data["id"] for data in actions], list({data["created_utc"] for data in actions})
+
+
+def queue(sql, to_alert, received):
+    """Claim the actions in ``to_alert``, a dict of webhook to actions, and queue their alerts. ``received`` maps
+    action ids to when the streamer received them.
+
+    Actions that are already pinged, or claimed by another task, are skipped. Returns how many actions were claimed.
+    """
+    global _created
+    if not _created:
+        sql.execute(CREATE_QUERY)
+        _created = True
+    actions = list({data["id"]: data for actions in to_alert.values() for data in actions}.values())
+    sql.execute("BEGIN;")
+    try:
+        sql.execute(CLAIM_ACTIONS_QUERY, _ids(actions))
+        claimed = {result.id for result in sql.fetchall()}
+        rows = [
+            (webhook, data["id"], data["created_utc"], received.get(data["id"]))
+            for webhook, webhook_actions in to_alert.items()
+            for data in webhook_actions
+            if data["id"] in claimed
+        ]
+        if rows:
+            execute_values(sql, QUEUE_QUERY, rows)
+        sql.execute("COMMIT;")
+    except Exception:
+        sql.execute("ROLLBACK;")
+        raise
+    return len(claimed)
+
+
+def take(sql, webhook):
+    """Lock and return the alerts waiting for ``webhook`` as ``(actions, received)``. Call inside a transaction."""
+    sql.execute(TAKE_QUERY, (webhook,))
+    actions = []
+    received = {}
+    for result in sql.fetchall():
+        data = {column: getattr(result, column) for column in COLUMNS}
+        actions.append(data)
+        received[data["id"]] = result.received
+    return actions, received
+
+
+def remove(sql, webhook, actions, release=False):
+    """Delete ``actions``' alerts for ``webhook``. With ``release`` the actions can be claimed again."""
+    if actions:
+        sql.execute(REMOVE_QUERY, (webhook, *_ids(actions)))
+        if release:
+            sql.execute(RELEASE_QUERY, _ids(actions))
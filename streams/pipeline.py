@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import log
+from .retry import broker
+from .routers import fair_queue
+from .stream_config import fair_quantum, metrics_interval, publish_queue_size, publish_retry_delay
+
+
+class Publisher:
+    """Publishes ingest chunks from one dedicated thread.
+
+    Batches wait in a bounded queue, so :meth:`put` blocks once the broker falls behind. Everything queued when the
+    thread becomes free is sent in a single executor call. With ``fair`` each chunk goes to its subreddits'
+    action_chunks bucket queue, and the buckets' chunks are interleaved by deficit round robin so a big backlog in
+    one bucket doesn't hold back the others.
+    """
+
+    def __init__(
+        self,
+        task,
+        queue="action_chunks",
+        max_pending=publish_queue_size,
+        max_batches=10,
+        priority=1,
+        fair=True,
+        quantum=fair_quantum,
+    ):
+        self.task = task
+        self.queue_name = queue
+        self.fair = fair
+        self.quantum = quantum
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.max_batches = max_batches
+        self.priority = priority
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"publisher-{queue}")
+        self.published = 0
+
+    async def put(self, chunks, on_published=None, **kwargs):
+        """Queue ``chunks`` to be sent as one task each with ``kwargs``, then await ``on_published`` once sent."""
+        await self.queue.put((chunks, kwargs, on_published))
+
+    def _schedule(self, batches):
+        """Yield ``(queue, chunk, kwargs)`` for every chunk in ``batches``, by deficit round robin over the queues."""
+        pending = {}
+        for chunks, kwargs, _ in batches:
+            for chunk in chunks:
+                queue = fair_queue(chunk[0][0]["subreddit"]) if self.fair else self.queue_name
+                pending.setdefault(queue, deque()).append((chunk, kwargs))
+        deficits = dict.fromkeys(pending, 0)
+        while pending:
+            for queue in list(pending):
+                deficits[queue] += self.quantum
+                chunks = pending[queue]
+                while chunks and len(chunks[0][0]) <= deficits[queue]:
+                    chunk, kwargs = chunks.popleft()
+                    deficits[queue] -= len(chunk)
+                    yield queue, chunk, kwargs
+                if not chunks:
+                    del pending[queue]
+
+    def _publish(self, batches):
+        # the producer is only held for one send, the pool is shared by every publisher in the process
+        with self.task.app.producer_pool.acquire(block=True) as producer:
+            for queue, chunk, kwargs in self._schedule(batches):
+                # queued is when the chunk entered the broker, the workers report queueing delay from it
+                self.task.apply_async(
+                    args=(chunk,),
+                    kwargs={**kwargs, "queued": time.time()},
+                    priority=self.priority,
+                    queue=queue,
+                    producer=producer,
+                )
+                self.published += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batches = [await self.queue.get()]
+            while not self.queue.empty() and len(batches) < self.max_batches:
+                batches.append(self.queue.get_nowait())
+            # batches are never dropped, once the broker policy gives up they wait and start over
+            while True:
+                try:
+                    await broker.call_async(loop.run_in_executor, self.executor, self._publish, batches)
+                    break
+                except Exception as error:
+                    log.warning(
+                        f"Publishing {len(batches):,} batches failed, retrying in {publish_retry_delay}s: {error!r}"
+                    )
+                    await asyncio.sleep(publish_retry_delay)
+            for _, _, on_published in batches:
+                if on_published:
+                    try:
+                        await on_published()
+                    except Exception as error:
+                        log.exception(error)
+                self.queue.task_done()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class PipelineMetrics:
+    """Samples queue depths every second and logs peak depths and stage counters every ``interval`` seconds.
+
+    ``reporters`` are called after each report so other per-stream summaries are logged on the same timer.
+    """
+
+    def __init__(self, name, queues, interval=metrics_interval, reporters=()):
+        self.name = name
+        self.queues = queues
+        self.interval = interval
+        self.reporters = reporters
+        self.counters = Counter()
+        self.peaks = Counter()
+
+    def count(self, key, amount=1):
+        self.counters[key] += amount
+
+    def report(self):
+        depths = " | ".join(
+            f"{name} {queue.qsize():,}/{queue.maxsize:,} (peak {self.peaks[name]:,})"
+            for name, queue in self.queues.items()
+        )
+        counters = " | ".join(f"{key} {value:,}" for key, value in sorted(self.counters.items()))
+        log.info(f"{self.name} | {depths} | {counters}")
+        self.counters.clear()
+        self.peaks.clear()
+        for reporter in self.reporters:
+            reporter()
+
+    async def run(self):
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            for name, queue in self.queues.items():
+                self.peaks[name] = max(self.peaks[name], queue.qsize())
+            if (time.monotonic() - last_report) >= self.interval:
+                last_report = time.monotonic()
+                self.report()
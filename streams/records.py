@@ -0,0 +1,134 @@
+from datetime import datetime, timezone
+
+from . import mapping, skip_keys, thingTypes
+from .utils import compile_mapping
+
+COLUMNS = (
+    "id",
+    "created_utc",
+    "moderator",
+    "subreddit",
+    "mod_action",
+    "details",
+    "description",
+    "target_author",
+    "target_body",
+    "target_type",
+    "target_id",
+    "target_permalink",
+    "target_title",
+)
+
+
+class ActionRecord:
+    """A modlog action holding only the ``mirror.modlog`` columns.
+
+    Supports the ``data["key"]``/``data.get("key")`` access the tasks and embeds use for mapped action dicts.
+    """
+
+    __slots__ = COLUMNS
+
+    def __init__(
+        self,
+        id,
+        created_utc,
+        moderator,
+        subreddit,
+        mod_action,
+        details=None,
+        description=None,
+        target_author=None,
+        target_body=None,
+        target_type=None,
+        target_id=None,
+        target_permalink=None,
+        target_title=None,
+    ):
+        self.id = id
+        self.created_utc = created_utc
+        self.moderator = moderator
+        self.subreddit = subreddit
+        self.mod_action = mod_action
+        self.details = details
+        self.description = description
+        self.target_author = target_author
+        self.target_body = target_body
+        self.target_type = target_type
+        self.target_id = target_id
+        self.target_permalink = target_permalink
+        self.target_title = target_title
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __eq__(self, other):
+        if isinstance(other, ActionRecord):
+            return self.as_tuple() == other.as_tuple()
+        return NotImplemented
+
+    def __reduce__(self):
+        return ActionRecord, self.as_tuple()
+
+    def __repr__(self):
+        return f"<ActionRecord(subreddit={self.subreddit!r}, mod={self.moderator!r}, action={self.mod_action!r})>"
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def as_tuple(self):
+        return (
+            self.id,
+            self.created_utc,
+            self.moderator,
+            self.subreddit,
+            self.mod_action,
+            self.details,
+            self.description,
+            self.target_author,
+            self.target_body,
+            self.target_type,
+            self.target_id,
+            self.target_permalink,
+            self.target_title,
+        )
+
+    def as_dict(self):
+        return {key: value for key, value in zip(COLUMNS, self.as_tuple()) if value is not None}
+
+
+def decode_action(data):
+    target_fullname = data.get("target_fullname")
+    if target_fullname:
+        target_prefix, _, target_id = target_fullname.partition("_")
+        target_type = thingTypes[target_prefix]
+    else:
+        target_type = target_id = None
+    created_utc = data.get("created_utc")
+    return ActionRecord(
+        data["id"].partition("_")[2] or None,
+        datetime.fromtimestamp(created_utc, timezone.utc) if created_utc else None,
+        data.get("mod"),
+        data.get("subreddit"),
+        data.get("action"),
+        data.get("details"),
+        data.get("description"),
+        data.get("target_author"),
+        data.get("target_body"),
+        target_type,
+        target_id,
+        data.get("target_permalink"),
+        data.get("target_title"),
+    )
+
+
+def decode_listing(listing):
+    """Decode a raw ``about/log`` listing response into action records and its ``after`` cursor."""
+    data = listing["data"]
+    return [decode_action(child["data"]) for child in data["children"]], data.get("after")
+
+
+map_action = compile_mapping(mapping, COLUMNS, ActionRecord, skip_keys)
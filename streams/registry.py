@@ -0,0 +1,112 @@
+"""Which subreddits the streamer follows and with which account, reloaded when ``redditmodhelper.subreddits`` changes.
+
+A trigger notifies :data:`CHANNEL` on every change to the table, :meth:`SubredditRegistry.watch` reloads the table and
+hands the new ``{modlog account: subreddits}`` mapping to its callback.
+"""
+import asyncio
+import random
+from collections import defaultdict
+
+import psycopg2
+
+from . import Session, log, url
+from .models import Subreddit
+
+CHANNEL = "subreddit_registry"
+TRIGGER_QUERIES = [
+    """CREATE OR REPLACE FUNCTION redditmodhelper.notify_subreddit_registry() RETURNS trigger AS $$
+       BEGIN
+           PERFORM pg_notify('subreddit_registry', CASE TG_OP WHEN 'DELETE' THEN OLD.name ELSE NEW.name END);
+           RETURN NULL;
+       END;
+       $$ LANGUAGE plpgsql;
+       """,
+    "DROP TRIGGER IF EXISTS notify_subreddit_registry ON redditmodhelper.subreddits;",
+    """CREATE TRIGGER notify_subreddit_registry AFTER INSERT OR UPDATE OR DELETE ON redditmodhelper.subreddits
+       FOR EACH ROW EXECUTE PROCEDURE redditmodhelper.notify_subreddit_registry();
+       """,
+]
+
+
+def install_triggers():
+    connection = psycopg2.connect(url)
+    try:
+        with connection, connection.cursor() as sql:
+            for query in TRIGGER_QUERIES:
+                sql.execute(query)
+    finally:
+        connection.close()
+    log.info("Installed subreddit registry trigger")
+
+
+class SubredditRegistry:
+    """Watches the subreddits table for the streamer.
+
+    Changes are debounced for ``debounce`` seconds so adding a subreddit (which writes a few rows) reconfigures the
+    streams once. A lost connection is reopened after a reload, notifications sent while it was gone are lost.
+    """
+
+    def __init__(self, debounce=2, reconnect_delay=30):
+        self.debounce = debounce
+        self.reconnect_delay = reconnect_delay
+
+    @staticmethod
+    def load():
+        accounts = defaultdict(set)
+        try:
+            for subreddit in Subreddit.query.all():
+                accounts[subreddit.modlog_account].add(subreddit.name)
+        finally:
+            # a fresh session every time, the identity map would otherwise keep serving the old modlog accounts
+            Session.remove()
+        return dict(accounts)
+
+    @staticmethod
+    def _listen():
+        connection = psycopg2.connect(url)
+        connection.autocommit = True
+        with connection.cursor() as sql:
+            sql.execute(f"LISTEN {CHANNEL};")
+        return connection
+
+    async def watch(self, callback):
+        """Await ``callback(accounts)`` with the current subreddits now and after every change. Never returns."""
+        loop = asyncio.get_running_loop()
+        while True:
+            connection = None
+            try:
+                connection = await loop.run_in_executor(None, self._listen)
+                changed = asyncio.Event()
+                errors = []
+
+                def on_notify():
+                    try:
+                        connection.poll()
+                    except Exception as error:
+                        errors.append(error)
+                    if connection.notifies or errors:
+                        connection.notifies.clear()
+                        changed.set()
+
+                loop.add_reader(connection.fileno(), on_notify)
+                try:
+                    # listening before loading, so nothing changed in between is missed
+                    await callback(await loop.run_in_executor(None, self.load))
+                    while True:
+                        await changed.wait()
+                        if errors:
+                            raise errors[0]
+                        await asyncio.sleep(self.debounce)
+                        changed.clear()
+                        log.info("Subreddits changed, reloading")
+                        await callback(await loop.run_in_executor(None, self.load))
+                finally:
+                    loop.remove_reader(connection.fileno())
+            except Exception as error:
+                log.exception(error)
+                delay = random.uniform(self.reconnect_delay / 2, self.reconnect_delay)
+                log.warning(f"Subreddit registry listener disconnected, reconnecting in {delay:.0f}s")
+                await asyncio.sleep(delay)
+            finally:
+                if connection is not None:
+                    connection.close()
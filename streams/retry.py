@@ -0,0 +1,190 @@
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+
+import pylibmc
+from kombu.exceptions import OperationalError
+
+from . import log
+from .stream_config import (
+    breaker_failure_threshold,
+    breaker_reset_timeout,
+    retry_base_delay,
+    retry_budget_minimum,
+    retry_budget_ratio,
+    retry_max_delay,
+    retry_report_interval,
+)
+
+_RAISE = object()
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calls to a dependency after ``failure_threshold`` consecutive failures.
+
+    Once ``reset_timeout`` seconds have passed, one trial call is let through. If it succeeds the breaker closes,
+    otherwise it stays open for another ``reset_timeout``.
+    """
+
+    def __init__(self, name, failure_threshold=breaker_failure_threshold, reset_timeout=breaker_reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if (time.monotonic() - self.opened_at) >= self.reset_timeout:
+            # let one trial through and hold everyone else back until it reports
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def remaining(self):
+        if self.opened_at is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def succeeded(self):
+        if self.opened_at is not None:
+            log.info(f"{self.name} circuit closed")
+        self.failures = 0
+        self.opened_at = None
+
+    def failed(self):
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.failure_threshold:
+            log.warning(f"{self.name} circuit opened after {self.failures:,} failures")
+            self.opened_at = time.monotonic()
+        elif self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """Retries calls to one dependency with jittered exponential backoff behind a :class:`CircuitBreaker`.
+
+    :meth:`call` sleeps between attempts and is meant for the sync streamer's processes. :meth:`call_async` awaits
+    instead, so a dependency outage only stalls the coroutines that need it. Both return ``default`` once attempts run
+    out or the breaker is open, or re-raise when no default is given. Counters are logged every
+    ``retry_report_interval`` seconds when anything was retried or failed.
+    """
+
+    def __init__(
+        self, name, exceptions=(Exception,), max_attempts=3, base_delay=retry_base_delay, max_delay=retry_max_delay
+    ):
+        self.name = name
+        self.exceptions = exceptions
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(name)
+        self.stats = Counter()
+        self.last_report = time.monotonic()
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def _can_retry(self):
+        budget = max(retry_budget_minimum, self.stats["calls"] * retry_budget_ratio)
+        if self.stats["retries"] >= budget:
+            self.stats["budget_exhausted"] += 1
+            return False
+        return True
+
+    def _report(self):
+        if (time.monotonic() - self.last_report) < retry_report_interval:
+            return
+        self.last_report = time.monotonic()
+        if self.stats["retries"] or self.stats["failures"] or self.stats["short_circuited"]:
+            counters = " | ".join(f"{key} {value:,}" for key, value in sorted(self.stats.items()))
+            log.info(f"{self.name} retries | {counters}{' | circuit open' if self.breaker.open else ''}")
+        self.stats.clear()
+
+    def succeeded(self):
+        self.breaker.succeeded()
+
+    def failed(self):
+        self.stats["failures"] += 1
+        self.breaker.failed()
+        self._report()
+
+    def _short_circuit(self, default):
+        self.stats["short_circuited"] += 1
+        self._report()
+        if default is _RAISE:
+            raise CircuitOpen(f"{self.name} circuit is open")
+        return default
+
+    def _give_up(self, error, default):
+        self._report()
+        if default is _RAISE:
+            raise error
+        log.warning(f"Giving up on {self.name} call: {error!r}")
+        return default
+
+    def call(self, func, *args, default=_RAISE, **kwargs):
+        self.stats["calls"] += 1
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                return self._short_circuit(default)
+            try:
+                result = func(*args, **kwargs)
+            except self.exceptions as error:
+                self.failed()
+                if attempt + 1 >= self.max_attempts or self.breaker.open or not self._can_retry():
+                    return self._give_up(error, default)
+                self.stats["retries"] += 1
+                time.sleep(self.delay(attempt))
+            else:
+                self.succeeded()
+                return result
+
+    async def call_async(self, func, *args, default=_RAISE, **kwargs):
+        """Like :meth:`call`, but awaits the result when ``func`` returns an awaitable."""
+        self.stats["calls"] += 1
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                return self._short_circuit(default)
+            try:
+                result = func(*args, **kwargs)
+                if asyncio.isfuture(result) or asyncio.iscoroutine(result):
+                    result = await result
+            except self.exceptions as error:
+                self.failed()
+                if attempt + 1 >= self.max_attempts or self.breaker.open or not self._can_retry():
+                    return self._give_up(error, default)
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.delay(attempt))
+            else:
+                self.succeeded()
+                return result
+
+
+memcached = RetryPolicy("memcached", exceptions=(pylibmc.Error,), base_delay=0.1, max_delay=2)
+broker = RetryPolicy("broker", exceptions=(OperationalError, ConnectionError, OSError))
+_reddit_policies = {}
+_reddit_lock = threading.Lock()
+
+
+def reddit(account):
+    """Return ``account``'s Reddit policy, so one account's errors and rate limits only hold back its own pollers.
+
+    Reddit listings are reopened by the streamers themselves, they only use this for backoff delays and the breaker.
+    """
+    with _reddit_lock:
+        policy = _reddit_policies.get(account)
+        if policy is None:
+            policy = _reddit_policies[account] = RetryPolicy(f"reddit u/{account}", base_delay=1, max_delay=120)
+        return policy
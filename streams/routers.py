@@ -1,3 +1,31 @@
+import zlib
+
+from .stream_config import fair_queue_buckets
+
+
+def fair_queues(buckets=fair_queue_buckets):
+    """Return every action_chunks bucket queue, in bucket order."""
+    return [f"action_chunks.{bucket}" for bucket in range(buckets)]
+
+
+def fair_queue(subreddit, buckets=fair_queue_buckets):
+    """Return the action_chunks bucket queue ``subreddit``'s bulk chunks go to."""
+    return f"action_chunks.{zlib.crc32(subreddit.lower().encode()) % buckets}"
+
+
 def route_task(name, args, kwargs, options, task=None, **kw):
+    # explicit queues passed to apply_async win, this covers callers that leave the queue to the router
     if name == "streams.tasks.ingest_action_chunk":
-        return {"queue": "actions", "priority": (2 if args[1] else 1) + (2 if args[2] else 0)}
+        if any(admin for _, admin, _ in args[0]):
+            return {"queue": "admin_actions"}
+        return {"queue": fair_queue(args[0][0][0]["subreddit"])}
+    if name == "streams.tasks.ingest_action":
+        return {"queue": "admin_actions" if args[1] else "actions"}
+    if name in (
+        "streams.tasks.send_admin_alert",
+        "streams.tasks.send_admin_alerts",
+        "streams.tasks.flush_admin_alerts",
+    ):
+        return {"queue": "admin_alerts"}
+    if name == "streams.tasks.store_dead_letter":
+        return {"queue": "dead_letters"}
@@ -0,0 +1,157 @@
+"""In-memory subreddit to webhook routing, kept current through Postgres ``LISTEN``/``NOTIFY``.
+
+Triggers on ``redditmodhelper.webhooks`` and ``redditmodhelper.subreddits`` notify :data:`CHANNEL` with the subreddit
+that changed, and every :class:`WebhookRoutes` reloads just that subreddit's routes. Lookups are dict reads.
+"""
+import os
+import random
+import select
+import threading
+
+import psycopg2
+from psycopg2.extras import NamedTupleCursor
+
+from . import log, url
+
+CHANNEL = "webhook_routes"
+TRIGGER_QUERIES = [
+    """CREATE OR REPLACE FUNCTION redditmodhelper.notify_webhook_routes() RETURNS trigger AS $$
+       DECLARE
+           key TEXT := CASE TG_TABLE_NAME WHEN 'subreddits' THEN 'name' ELSE 'subreddit' END;
+       BEGIN
+           IF TG_OP IN ('UPDATE', 'DELETE') THEN
+               PERFORM pg_notify('webhook_routes', to_jsonb(OLD) ->> key);
+           END IF;
+           IF TG_OP IN ('INSERT', 'UPDATE') THEN
+               PERFORM pg_notify('webhook_routes', to_jsonb(NEW) ->> key);
+           END IF;
+           RETURN NULL;
+       END;
+       $$ LANGUAGE plpgsql;
+       """,
+    "DROP TRIGGER IF EXISTS notify_webhook_routes ON redditmodhelper.webhooks;",
+    """CREATE TRIGGER notify_webhook_routes AFTER INSERT OR UPDATE OR DELETE ON redditmodhelper.webhooks
+       FOR EACH ROW EXECUTE PROCEDURE redditmodhelper.notify_webhook_routes();
+       """,
+    "DROP TRIGGER IF EXISTS notify_webhook_routes ON redditmodhelper.subreddits;",
+    """CREATE TRIGGER notify_webhook_routes AFTER INSERT OR UPDATE OR DELETE ON redditmodhelper.subreddits
+       FOR EACH ROW EXECUTE PROCEDURE redditmodhelper.notify_webhook_routes();
+       """,
+]
+ROUTES_QUERY = """SELECT lower(webhooks.subreddit) AS subreddit,
+                      array_remove(array_agg(DISTINCT webhooks.admin_webhook), NULL) AS admin_webhooks,
+                      array_remove(array_agg(DISTINCT webhooks.alert_webhook), NULL) AS alert_webhooks
+                  FROM redditmodhelper.webhooks
+                  JOIN redditmodhelper.subreddits
+                      ON subreddits.name=webhooks.subreddit AND subreddits.server_id=webhooks.server_id
+                  {where}
+                  GROUP BY lower(webhooks.subreddit);
+                  """
+
+
+def install_triggers():
+    """Create (or replace) the notify triggers. Run from one process, the streamers do it on start."""
+    connection = psycopg2.connect(url)
+    try:
+        with connection, connection.cursor() as sql:
+            for query in TRIGGER_QUERIES:
+                sql.execute(query)
+    finally:
+        connection.close()
+    log.info("Installed webhook route triggers")
+
+
+class WebhookRoutes:
+    """Subreddit to webhooks table for one process.
+
+    The table and its listener thread start on first lookup in each process, so module-level instances survive
+    Celery's fork. When the listener loses its connection it reconnects and reloads everything, since notifications
+    sent while it was gone are lost.
+    """
+
+    def __init__(self, reconnect_delay=30):
+        self.reconnect_delay = reconnect_delay
+        self.routes = {}
+        self._pid = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = psycopg2.connect(url, cursor_factory=NamedTupleCursor)
+        connection.autocommit = True
+        return connection
+
+    def _load(self, connection, subreddits=None):
+        with connection.cursor() as sql:
+            if subreddits is None:
+                sql.execute(ROUTES_QUERY.format(where=""))
+            else:
+                sql.execute(ROUTES_QUERY.format(where="WHERE lower(webhooks.subreddit)=ANY(%s)"), (subreddits,))
+            results = sql.fetchall()
+        routes = {result.subreddit: (result.admin_webhooks, result.alert_webhooks) for result in results}
+        if subreddits is None:
+            self.routes = routes
+        else:
+            for subreddit in subreddits:
+                if subreddit in routes:
+                    self.routes[subreddit] = routes[subreddit]
+                else:
+                    self.routes.pop(subreddit, None)
+        return len(results)
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = self._connect()
+                with connection.cursor() as sql:
+                    sql.execute(f"LISTEN {CHANNEL};")
+                # listen before loading so nothing changed in between is missed
+                count = self._load(connection)
+                self._ready.set()
+                log.info(f"Loaded webhook routes for {count:,} subreddits")
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    changed = {notify.payload.lower() for notify in connection.notifies if notify.payload}
+                    connection.notifies.clear()
+                    if changed:
+                        self._load(connection, sorted(changed))
+                        log.info(f"Reloaded webhook routes for {', '.join(f'r/{name}' for name in sorted(changed))}")
+            except Exception as error:
+                log.exception(error)
+                delay = random.uniform(self.reconnect_delay / 2, self.reconnect_delay)
+                log.warning(f"Webhook route listener disconnected, reconnecting in {delay:.0f}s")
+                threading.Event().wait(delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.routes = {}
+            self._ready = threading.Event()
+            threading.Thread(target=self._listen, name="webhook-routes", daemon=True).start()
+            self._pid = os.getpid()
+        # only the first lookup in a process waits, for the initial load
+        self._ready.wait(30)
+
+    def _lookup(self, subreddits, index):
+        self._ensure_started()
+        webhooks = {}
+        for subreddit in subreddits:
+            route = self.routes.get(subreddit.lower())
+            if route and route[index]:
+                webhooks[subreddit] = route[index]
+        return webhooks
+
+    def admin_webhooks(self, subreddits):
+        return self._lookup(subreddits, 0)
+
+    def alert_webhooks(self, subreddits):
+        return self._lookup(subreddits, 1)
@@ -0,0 +1,87 @@
+"""Compare the memory and CPU footprint of running sync streamer layouts.
+
+Start the sync streamer once with ``STREAMS_SYNC_RUNTIME=process`` and once with ``STREAMS_SYNC_RUNTIME=threads``
+(one after the other or side by side on a copy of the config), then point this at each one's parent PID::
+
+    python -m streams.runtime_report process=12345 threads=23456 --seconds 60
+
+Every layout is measured over the whole process tree below its PID. RSS counts pages shared between forked processes
+once per process, so USS (memory unique to each process) is the fairer total when comparing the two.
+
+This comparison has not been run yet: the environment the threads runtime was written in has neither psutil nor the
+streamer's dependencies, so there are no RSS/CPU numbers to back the "threads" layout. Run it against real streamers
+and record the results before changing the default ``sync_runtime``.
+"""
+import argparse
+import time
+
+import psutil
+
+
+def _tree(pid):
+    root = psutil.Process(pid)
+    return [root] + root.children(recursive=True)
+
+
+def _cpu_seconds(processes):
+    total = 0
+    for process in processes:
+        try:
+            times = process.cpu_times()
+            total += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def measure(pid, seconds):
+    processes = _tree(pid)
+    start_cpu = _cpu_seconds(processes)
+    start = time.monotonic()
+    time.sleep(seconds)
+    elapsed = time.monotonic() - start
+    cpu = _cpu_seconds(processes) - start_cpu
+    rss = uss = threads = 0
+    alive = 0
+    for process in processes:
+        try:
+            memory = process.memory_full_info()
+            threads += process.num_threads()
+        except psutil.NoSuchProcess:
+            continue
+        rss += memory.rss
+        uss += memory.uss
+        alive += 1
+    return {
+        "processes": alive,
+        "threads": threads,
+        "rss_mb": rss / 1024**2,
+        "uss_mb": uss / 1024**2,
+        "cpu_percent": cpu / elapsed * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("layouts", nargs="+", metavar="NAME=PID", help="a label and the parent PID of a streamer")
+    parser.add_argument("--seconds", type=float, default=30, help="how long to sample CPU time for")
+    args = parser.parse_args()
+    results = {}
+    for layout in args.layouts:
+        name, _, pid = layout.partition("=")
+        results[name] = measure(int(pid), args.seconds)
+    columns = ["processes", "threads", "rss_mb", "uss_mb", "cpu_percent"]
+    print(f"{'layout':<12}" + "".join(f"{column:>14}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<12}" + "".join(f"{result[column]:>14,.1f}" for column in columns))
+    if len(results) > 1:
+        baseline_name, baseline = next(iter(results.items()))
+        for name, result in list(results.items())[1:]:
+            print(
+                f"{name} vs {baseline_name}: USS {result['uss_mb'] / baseline['uss_mb']:.0%}, "
+                f"CPU {result['cpu_percent'] / max(baseline['cpu_percent'], 0.01):.0%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import json
+import math
+import struct
+from datetime import datetime, timezone
+
+from kombu.serialization import register
+
+from .records import COLUMNS, ActionRecord
+
+# Message layout (all integers big-endian):
+#   b"RMH" | version (B) | short indexes (B) | envelope length (I) | envelope JSON
+#   | string count (I) | strings | actions
+# Strings are a length (I) and UTF-8 bytes, each distinct value stored once. Every action is one fixed-size struct of
+# created_utc as a float timestamp (NaN for none) followed by the other columns in COLUMNS order as 1-based indexes
+# into the string table (0 for none), two bytes wide when the table is small enough and four otherwise. The envelope is
+# the Celery body with each ActionRecord replaced by {"$a": index} and datetimes by {"$dt": timestamp}.
+NAME = "modlog"
+CONTENT_TYPE = "application/x-rmh-modlog"
+MAGIC = b"RMH"
+SCHEMA_VERSION = 1
+
+_HEADER = struct.Struct("!3sBBI")
+_COUNT = struct.Struct("!I")
+_LENGTH = struct.Struct("!I")
+_ACTION = struct.Struct(f"!d{len(COLUMNS) - 1}I")
+_ACTION_SHORT = struct.Struct(f"!d{len(COLUMNS) - 1}H")
+# the packed row is created_utc followed by the remaining columns, so it relies on it being the second column
+assert COLUMNS.index("created_utc") == 1
+
+
+def _pack_actions(actions):
+    strings = {None: 0}
+    rows = []
+    for action in actions:
+        id, created_utc, *values = action.as_tuple()
+        row = [created_utc.timestamp() if created_utc is not None else math.nan]
+        for value in (id, *values):
+            index = strings.get(value)
+            if index is None:
+                index = strings[value] = len(strings)
+            row.append(index)
+        rows.append(row)
+    del strings[None]
+    action_struct = _ACTION_SHORT if len(strings) < 0xFFFF else _ACTION
+    parts = [_COUNT.pack(len(strings))]
+    for string in strings:
+        encoded = str(string).encode()
+        parts.append(_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    parts.extend(action_struct.pack(*row) for row in rows)
+    return action_struct is _ACTION_SHORT, parts
+
+
+def _unpack_actions(view, offset, short):
+    (count,) = _COUNT.unpack_from(view, offset)
+    offset += _COUNT.size
+    strings = [None]
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        strings.append(str(view[offset : offset + length], "utf-8"))
+        offset += length
+    actions = []
+    for created_utc, id, *values in (_ACTION_SHORT if short else _ACTION).iter_unpack(view[offset:]):
+        actions.append(
+            ActionRecord(
+                strings[id],
+                None if math.isnan(created_utc) else datetime.fromtimestamp(created_utc, timezone.utc),
+                *[strings[index] for index in values],
+            )
+        )
+    return actions
+
+
+def dumps(body):
+    actions = []
+
+    def default(value):
+        if isinstance(value, ActionRecord):
+            actions.append(value)
+            return {"$a": len(actions) - 1}
+        if isinstance(value, datetime):
+            return {"$dt": value.timestamp()}
+        if isinstance(value, (set, frozenset)):
+            return list(value)
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable by {NAME}")
+
+    envelope = json.dumps(body, default=default, separators=(",", ":")).encode()
+    short, parts = _pack_actions(actions)
+    return b"".join([_HEADER.pack(MAGIC, SCHEMA_VERSION, short, len(envelope)), envelope, *parts])
+
+
+def loads(data):
+    view = memoryview(data)
+    magic, version, short, envelope_length = _HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Not a {NAME} message")
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Unsupported {NAME} schema version {version}")
+    offset = _HEADER.size
+    envelope = bytes(view[offset : offset + envelope_length])
+    actions = _unpack_actions(view, offset + envelope_length, short)
+
+    def object_hook(value):
+        if len(value) == 1:
+            if "$a" in value:
+                return actions[value["$a"]]
+            if "$dt" in value:
+                return datetime.fromtimestamp(value["$dt"], timezone.utc)
+        return value
+
+    return json.loads(envelope, object_hook=object_hook)
+
+
+register(NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary")
@@ -0,0 +1,86 @@
+"""Packs subreddits into multireddit stream pollers by how many actions each one sees.
+
+A listing page holds 100 actions, so a poller whose subreddits log more than that between polls misses actions. Each
+subreddit's load is its average actions per second over ``shard_rate_window`` times the poll interval, and pollers are
+filled first fit decreasing up to ``shard_actions_per_poll``. A subreddit busier than that on its own gets a poller to
+itself.
+"""
+import math
+
+from . import ConnectionManager, connection_pool
+from .stream_config import (
+    shard_actions_per_poll,
+    shard_max_subreddits,
+    shard_poll_interval,
+    shard_rate_window,
+    shard_unknown_rate,
+)
+
+RATES_QUERY = """SELECT lower(subreddit) AS subreddit, count(*) AS actions FROM mirror.modlog
+                 WHERE created_utc >= now() - make_interval(secs => %s) AND lower(subreddit)=ANY(%s)
+                 GROUP BY lower(subreddit);
+                 """
+
+
+def load_rates(subreddits, window=shard_rate_window, pool=connection_pool):
+    """Return each subreddit's actions per second over the last ``window`` seconds, keyed by lower cased name."""
+    with ConnectionManager(pool) as sql:
+        sql.execute(RATES_QUERY, (window, [subreddit.lower() for subreddit in subreddits]))
+        return {result.subreddit: result.actions / window for result in sql.fetchall()}
+
+
+class SubredditSharder:
+    """Plans the poller groups of one account's subreddits.
+
+    :meth:`plan` keeps the current groups that still fit so a change only restarts the pollers it touches, and falls
+    back to a full repack once the kept layout uses more than ``1 + slack`` times the pollers a repack would.
+    """
+
+    def __init__(
+        self,
+        rates=None,
+        budget=shard_actions_per_poll,
+        poll_interval=shard_poll_interval,
+        max_subreddits=shard_max_subreddits,
+        unknown_rate=shard_unknown_rate,
+        slack=0.25,
+    ):
+        self.rates = rates or {}
+        self.budget = budget
+        self.poll_interval = poll_interval
+        self.max_subreddits = max_subreddits
+        self.unknown_rate = unknown_rate
+        self.slack = slack
+
+    def load(self, subreddit):
+        return self.rates.get(subreddit.lower(), self.unknown_rate) * self.poll_interval
+
+    def group_load(self, group):
+        return sum(self.load(subreddit) for subreddit in group)
+
+    def fits(self, group):
+        return len(group) == 1 or (len(group) <= self.max_subreddits and self.group_load(group) <= self.budget)
+
+    def pack(self, subreddits):
+        bins = []
+        for subreddit in sorted(subreddits, key=lambda subreddit: (-self.load(subreddit), subreddit)):
+            load = self.load(subreddit)
+            for group in bins:
+                if len(group[1]) < self.max_subreddits and group[0] + load <= self.budget:
+                    group[0] += load
+                    group[1].add(subreddit)
+                    break
+            else:
+                bins.append([load, {subreddit}])
+        return [frozenset(group) for _, group in bins]
+
+    def plan(self, subreddits, current=()):
+        """Return the groups to run for ``subreddits`` given the ``current`` ones."""
+        wanted = set(subreddits)
+        kept = [frozenset(group & wanted) for group in current if group & wanted]
+        kept = [group for group in kept if self.fits(group)]
+        planned = kept + self.pack(wanted - set().union(*kept))
+        repacked = self.pack(wanted)
+        if len(planned) > math.ceil(len(repacked) * (1 + self.slack)):
+            return repacked
+        return planned
@@ -0,0 +1,124 @@
+import os
+import socket
+
+# "watermark" dedupes against per-subreddit high-water marks persisted in mirror.stream_watermarks,
+# "cache" uses the old per-action memcached add. Workers only read and write the memcached keys in "cache" mode, so
+# they need the same setting as the streamers.
+dedupe_mode = os.environ.get("STREAMS_DEDUPE_MODE", "watermark")
+watermark_grace = 120  # seconds before the committed mark that are still checked against boundary ids
+watermark_retention = 3600  # seconds of recent ids kept in memory behind the newest action
+checkpoint_interval = 30
+
+# accounts whose actions are always tagged admin, actions by anyone else are tagged admin when they come off the live
+# stream and the moderator isn't on the subreddit's mod list
+admin_moderators = {"Anti-Evil Operations", "Reddit Legal"}
+moderator_refresh_interval = 600
+moderator_recheck_interval = 60  # shortest gap between refetching a mod list to check a moderator missing from it
+admin_backlog_interval = 60  # seconds between walks of the mod=a backlog, which catches admins the mod lists miss
+raw_listings = True  # decode backlog pages straight into ActionRecords instead of asyncpraw ModActions
+
+# how ingest_action_chunk writes batches: "copy" stages them and inserts only new rows, "upsert" is the old
+# INSERT ... ON CONFLICT DO UPDATE
+ingest_write_mode = os.environ.get("STREAMS_INGEST_WRITE_MODE", "copy")
+
+accept_pickle = os.environ.get("STREAMS_ACCEPT_PICKLE", "1") == "1"
+
+# async streamer batching: a batch is published once it holds batch_max_size actions, contains an admin action or its
+# oldest action has waited batch_max_latency seconds
+batch_max_size = 500
+batch_max_latency = 5
+# actions per ingest_action_chunk task are sized so a task takes about target_chunk_seconds on the workers
+chunk_min_size = 10
+chunk_max_size = 200
+target_chunk_seconds = 0.5
+ingest_latency_key = "ingest_row_latency"
+
+# async streamer pipeline: bounded queues between reading, dedupe and publishing so a slow broker or worker pushes
+# back on the Reddit readers instead of stalling the event loop
+read_queue_size = 1000
+publish_queue_size = 20  # batches
+publish_retry_delay = 5
+metrics_interval = 60
+
+# retries against memcached, the broker and Reddit back off with full jitter, and each dependency's breaker opens after
+# breaker_failure_threshold consecutive failures and lets one trial call through every breaker_reset_timeout seconds
+retry_base_delay = 0.5
+retry_max_delay = 30
+breaker_failure_threshold = 5
+breaker_reset_timeout = 30
+# retries are capped at retry_budget_ratio of calls (but always allow retry_budget_minimum) per report interval
+retry_budget_ratio = 0.2
+retry_budget_minimum = 10
+retry_report_interval = 60
+
+# per-action log lines are sampled to log_sample_limit per subreddit every log_sample_window seconds (admin actions are
+# always logged) and every stream logs a summary of what it saw every log_summary_interval seconds
+log_sample_limit = 5
+log_sample_window = 10
+log_summary_interval = 60
+
+# admin alert latency (Reddit created_utc -> streamer receive -> webhook send) percentiles are logged every
+# alert_latency_interval seconds by the alert workers, with a warning when the p95 end to end is over the target
+alert_latency_target = 60
+alert_latency_interval = 300
+
+# "process" runs every sync stream loop in its own process, "threads" runs them as threads spread over
+# sync_worker_processes processes (more if that would put over sync_threads_per_process loops in one process)
+sync_runtime = os.environ.get("STREAMS_SYNC_RUNTIME", "process")
+sync_worker_processes = 4
+sync_threads_per_process = 200
+backlog_prefetch = True  # sync backlog walks request the next page while the current one is deduped and published
+backlog_interval = 300  # seconds the sync and async unfiltered backlog walks wait between walks
+
+# historical backfill (python -m streams.backfill): progress and throughput are logged every backfill_report_interval
+backfill_report_interval = 30
+backfill_max_failures = 10  # pages in a row that can fail before a subreddit is skipped for the run
+
+# mirror.modlog monthly partitions are kept this many months ahead of the newest action written
+partition_months_ahead = 3
+
+# ingest tasks retry transient failures after ingest_retry_base * 2 ** retries seconds (capped at ingest_retry_max, with
+# jitter) and dead-letter them after ingest_max_retries
+ingest_max_retries = 8
+ingest_retry_base = 5
+ingest_retry_max = 600
+
+# webhook delivery: attempts per message, keep-alive connections in the shared session and how often throughput is
+# logged
+webhook_max_attempts = 5
+webhook_connection_limit = 20
+webhook_report_interval = 60
+
+# admin alerts wait alert_coalesce_window seconds in mirror.pending_alerts, so a sweep spread over many ingest tasks is
+# sent per webhook as messages of up to 10 embeds. A burst needing more than alert_max_messages messages is cut short
+# with a summary embed
+alert_coalesce_window = 2
+alert_max_messages = 5
+
+# stream pollers are packed from each subreddit's action rate over the last shard_rate_window seconds so a poller
+# expects at most shard_actions_per_poll actions (half a listing page) every shard_poll_interval seconds, and repacked
+# every shard_rebalance_interval seconds. Subreddits without history count as shard_unknown_rate actions per second.
+shard_actions_per_poll = 50
+shard_poll_interval = 5
+shard_max_subreddits = 100
+shard_rate_window = 7 * 86400
+shard_unknown_rate = 0.5
+shard_rebalance_interval = 3600
+
+# stream nodes: subreddits hash into stream_shards shards, spread over the live nodes by consistent hashing, and a node
+# only streams the shards it holds a lease on. Leases last stream_lease_ttl seconds and are renewed every
+# stream_lease_renew_interval seconds, a dead node's shards are taken over once they expire. Give every process its
+# own STREAMS_NODE to run several on one host.
+stream_node = os.environ.get("STREAMS_NODE", socket.gethostname())
+stream_shards = 64
+stream_lease_ttl = 30
+stream_lease_renew_interval = 10
+
+# bulk ingest chunks are spread over fair_queue_buckets action_chunks.N queues by subreddit. Workers consuming all of
+# them take from the buckets round robin, so one subreddit's backfill only backs up its own bucket. Publishers
+# interleave the buckets by deficit round robin, fair_quantum actions per bucket per round. Workers log per-subreddit
+# queueing delay every queue_delay_interval seconds and warn about subreddits whose p95 is over queue_delay_target.
+fair_queue_buckets = 16
+fair_quantum = 100
+queue_delay_interval = 60
+queue_delay_target = 30
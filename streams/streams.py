@@ -1,45 +1,128 @@
 import asyncio
 import os.path
-from collections import defaultdict
-
-import sys
 import time
+from collections import defaultdict
 from datetime import datetime, timedelta
-from itertools import zip_longest
+from functools import partial
 from multiprocessing import freeze_support
 
 import aiostream
 import asyncpraw
 import asyncprawcore
-import pylibmc
 from credmgr.exceptions import NotFound
 
 from streams.tasks import ingest_action_chunk
-from streams.utils import map_values, try_multiple
 
-from . import cache, connection_pool, log, mapping, services, skip_keys
-from .models import Subreddit, Webhook
+from . import cache, connection_pool, log, services
+from .activity import ActionLog
+from .admins import AdminClassifier
+from .batching import ActionBatcher, ChunkSizer
+from .cursors import BacklogCursors
+from .leases import ShardLeases
+from .listings import RawModlogListing
+from .models import Subreddit
+from .pipeline import PipelineMetrics, Publisher
+from .records import map_action
+from .registry import SubredditRegistry
+from .registry import install_triggers as install_registry_triggers
+from .retry import memcached, reddit
+from .routing import install_triggers
+from .sharding import SubredditSharder, load_rates
+from .stream_config import (
+    admin_backlog_interval,
+    backlog_interval,
+    checkpoint_interval,
+    dedupe_mode,
+    raw_listings,
+    read_queue_size,
+    shard_rebalance_interval,
+)
+from .watermarks import Watermarks
 
 
 class ModLogStreams:
+    """Streams the mod log of a group of subreddits through three stages joined by bounded queues.
+
+    The reader pulls the live stream and the backlog into ``read_queue``, the processor dedupes and batches what it
+    takes off that queue, and the :class:`Publisher` sends finished batches to the broker. When the broker or workers
+    fall behind, the queues fill up and the reader stops pulling from Reddit until there is room again.
+    """
+
     def __init__(self, reddit_params, subreddits, redditor):
         self.redditor = redditor
+        self.reddit_retry = reddit(redditor)
         self.subreddits = subreddits
         self.reddit = asyncpraw.Reddit(**reddit_params, timeout=30)
         self.killed = False
+        self.reader = None
+        self.watermarks = None
+        if dedupe_mode == "watermark":
+            self.watermarks = Watermarks(subreddits, backlogs=1)
+        self.cursors = BacklogCursors(subreddits, ["all", "a"])
+        self.admins = AdminClassifier(self.reddit, subreddits)
+        self.batcher = ActionBatcher(self._flush)
+        self.chunk_sizer = ChunkSizer()
+        self.last_checkpoint = time.time()
+        self.read_queue = asyncio.Queue(maxsize=read_queue_size)
+        self.publisher = Publisher(ingest_action_chunk)
+        # admin actions skip the bulk publish queue and go out on their own thread and producer
+        self.admin_publisher = Publisher(
+            ingest_action_chunk, queue="admin_actions", max_pending=0, priority=2, fair=False
+        )
+        self.received = {}
+        self.activity = ActionLog(f"r/{'+'.join(subreddits)}")
+        self.metrics = PipelineMetrics(
+            f"r/{'+'.join(subreddits)}",
+            {"read": self.read_queue, "publish": self.publisher.queue, "admin": self.admin_publisher.queue},
+            reporters=[self.activity.report],
+        )
 
-    async def _log_wrapper(self, subreddit, admin, stream):
+    async def _backlog(self, sub, mod_filter):
+        # cursor updates are yielded alongside the actions and only run once the processor has handled the action
+        walk = self.cursors.walk(mod_filter)
+        for after in walk.segments():
+            params = {"after": after} if after else {}
+            if mod_filter != "all":
+                params["mod"] = mod_filter
+            if raw_listings:
+                modlog = RawModlogListing(self.reddit, sub, params=params)
+            else:
+                modlog = sub.mod.log(limit=None, params=params)
+            page_after = seen_after = after
+            async for action in modlog:
+                if modlog.params.get("after") != seen_after:
+                    page_after, seen_after = seen_after, modlog.params.get("after")
+                data = action if raw_listings else map_action(action.__dict__)
+                if walk.is_known(data["subreddit"], data["id"], data["created_utc"].timestamp()):
+                    if walk.finished:
+                        break
+                    continue
+                yield data, partial(walk.advance, page_after)
+        yield None, walk.finish
+
+    async def _log_wrapper(self, subreddit, stream, mod_filter="all"):
         sub = await self.reddit.subreddit(subreddit)
-        is_stream = True
-        while is_stream:
-            is_stream = stream
+        # the backlog walks repeat so their cursor heads keep up with the live stream, a restart then only walks what
+        # came in since the last walk instead of everything since the previous start
+        interval = admin_backlog_interval if mod_filter == "a" else backlog_interval
+        failures = 0
+        while True:
+            while not self.reddit_retry.breaker.allow():
+                await asyncio.sleep(max(1, self.reddit_retry.breaker.remaining()))
             try:
                 if stream:
-                    modlog = sub.mod.stream.log(mod=f"{'' if admin else '-'}a")
+                    async for action in sub.mod.stream.log():
+                        failures = 0
+                        self.reddit_retry.succeeded()
+                        yield action, stream, None, False
                 else:
-                    modlog = sub.mod.log(mod=f"{'' if admin else '-'}a", limit=None)
-                async for action in modlog:
-                    yield action, admin, stream
+                    async for data, callback in self._backlog(sub, mod_filter):
+                        failures = 0
+                        self.reddit_retry.succeeded()
+                        yield data, stream, callback, mod_filter == "a"
+                    if mod_filter == "all" and self.watermarks:
+                        yield None, stream, self.watermarks.backlog_complete, False
+                    await asyncio.sleep(interval)
             except Exception as error:
                 if hasattr(error, "response"):
                     if (
@@ -52,62 +135,247 @@ class ModLogStreams:
                         break
                     else:
                         log.exception(error)
+                self.reddit_retry.failed()
+                failures += 1
+                await asyncio.sleep(self.reddit_retry.delay(failures))
+
+    async def _read(self):
+        subreddits = "+".join(self.subreddits)
+        # the mod=a pass catches admin actions by accounts that aren't in admin_moderators and that the live mod list
+        # check missed, so admin detection is never weaker than the old filtered streams
+        modlogs = [
+            self._log_wrapper(subreddits, True),
+            self._log_wrapper(subreddits, False),
+            self._log_wrapper(subreddits, False, "a"),
+        ]
+        combine = aiostream.stream.merge(*modlogs)
+        async with combine.stream() as modlog:
+            async for action, stream, callback, admin in modlog:
+                await self.read_queue.put((action, stream, callback, admin, time.time()))
+                self.metrics.count("read")
+
+    async def _handle(self, action, stream, admin, received):
+        if stream:
+            await self.admins.refresh()
+            data = map_action(action.__dict__)
+        else:
+            data = action
+        # actions off the mod=a pass are always sent: one the unfiltered walks already sent untagged is only alerted
+        # now, and the workers skip alerts for rows that were already pinged
+        if await self._is_new(data) or admin:
+            self.metrics.count("new")
+            admin = admin or await self.admins.is_admin(data["moderator"], data["subreddit"], stream)
+            self.activity.record(data, True, admin, stream)
+            if admin:
+                self.received[data["id"]] = received
+            await self.batcher.add([data, admin, stream], admin)
+        else:
+            self.activity.record(data, False, stream=stream)
+
+    async def _process(self):
+        while True:
+            action, stream, callback, admin, received = await self.read_queue.get()
+            try:
+                if action is not None:
+                    await self._handle(action, stream, admin, received)
+                if callback:
+                    callback()
+            except Exception as error:
+                log.exception(error)
+            finally:
+                self.read_queue.task_done()
+
+    async def _is_new(self, data):
+        if self.watermarks:
+            return self.watermarks.is_new(data)
+        return await memcached.call_async(cache.add, data["id"], 1, default=False)
+
+    def _snapshot(self):
+        return self.watermarks.snapshot() if self.watermarks else None, self.cursors.snapshot()
+
+    def _save(self, snapshot):
+        watermark_rows, cursor_rows = snapshot
+        if self.watermarks:
+            self.watermarks.save(watermark_rows)
+        self.cursors.save(cursor_rows)
+
+    async def _flush(self, actions):
+        # the checkpoint is cut before anything is awaited so it only covers actions in this or earlier batches, and
+        # only saved once the publisher has sent them
+        if self.watermarks:
+            self.watermarks.published(actions)
+        snapshot = None
+        if (time.time() - self.last_checkpoint) > checkpoint_interval:
+            self.last_checkpoint = time.time()
+            snapshot = self._snapshot()
+        admin_actions = [action for action in actions if action[1]]
+        admin_sent = None
+        if admin_actions:
+            admin_sent = asyncio.Event()
+
+            async def on_admin_published():
+                admin_sent.set()
+
+            received = {data["id"]: self.received.pop(data["id"], None) for data, _, _ in admin_actions}
+            await self.admin_publisher.put([admin_actions], on_admin_published, received=received)
+            actions = [action for action in actions if not action[1]]
+        chunks = self.chunk_sizer.chunks(actions)
+        log.info(f"Queueing {len(chunks):,} chunks with {len(actions):,} actions")
+        self.metrics.count("batched", len(actions) + len(admin_actions))
+
+        async def on_published():
+            # the snapshot also covers this batch's admin actions, which are sent by the other publisher
+            if admin_sent:
+                await admin_sent.wait()
+            self.metrics.count("published", len(actions) + len(admin_actions))
+            loop = asyncio.get_running_loop()
+            if snapshot:
+                await loop.run_in_executor(None, self._save, snapshot)
+            await loop.run_in_executor(None, self.chunk_sizer.refresh)
+
+        await self.publisher.put(chunks, on_published)
+
+    def _load(self):
+        if self.watermarks:
+            self.watermarks.load()
+        self.cursors.load()
 
     async def run(self):
-        while not self.killed:
+        await asyncio.get_running_loop().run_in_executor(None, self._load)
+        self.last_checkpoint = time.time()
+        stages = [
+            asyncio.create_task(stage)
+            for stage in [
+                self._process(),
+                self.batcher.run(),
+                self.publisher.run(),
+                self.admin_publisher.run(),
+                self.metrics.run(),
+            ]
+        ]
+        try:
+            while not self.killed:
+                try:
+                    self.reader = asyncio.create_task(self._read())
+                    await self.reader
+                except asyncio.CancelledError:
+                    if not self.killed:
+                        raise
+                except asyncprawcore.ServerError as error:
+                    log.info(error)
+                    self.reddit_retry.failed()
+                    await asyncio.sleep(self.reddit_retry.delay(self.reddit_retry.breaker.failures))
+                    log.info((self.subreddits, await self.reddit.user.me()))
+                except Exception as error:
+                    log.exception(error)
+        finally:
+            # drain every stage in order so nothing that was read is lost on shutdown
+            await self.read_queue.join()
+            await self.batcher.flush()
+            await self.admin_publisher.queue.join()
+            await self.publisher.queue.join()
+            for stage in stages:
+                stage.cancel()
+            self.admin_publisher.close()
+            self.publisher.close()
+            # everything read has been published, so the final checkpoint covers all of it
+            await asyncio.get_running_loop().run_in_executor(None, self._save, self._snapshot())
+
+    def stop(self):
+        """Stop reading from Reddit. :meth:`run` returns once everything already read has been published."""
+        self.killed = True
+        if self.reader:
+            self.reader.cancel()
+
+
+class StreamSupervisor:
+    """Runs the :class:`ModLogStreams` groups a :class:`SubredditSharder` plans for each modlog account.
+
+    :meth:`reconcile` only touches the groups a change affects: groups that are no longer planned are stopped (draining
+    their queues) before the new ones start, and every other group keeps streaming. :meth:`rebalance` refreshes the
+    subreddits' action rates and replans every ``shard_rebalance_interval`` seconds. With ``leases`` only the
+    subreddits in this node's shards are streamed.
+    """
+
+    def __init__(self, leases=None, rebalance_interval=shard_rebalance_interval):
+        self.leases = leases
+        self.rebalance_interval = rebalance_interval
+        self.sharder = SubredditSharder()
+        self.accounts = {}
+        self.last_rates = 0
+        # modlog account -> {frozenset of subreddits: (ModLogStreams, task)}
+        self.groups = defaultdict(dict)
+        self.lock = asyncio.Lock()
+
+    async def _start(self, redditor, subreddits):
+        subreddits = sorted(subreddits)
+        log.info(f"Building streams for r/{'+'.join(subreddits)} using u/{redditor}...")
+        try:
+            reddit_params = services.reddit(redditor).config._settings
+        except NotFound as error:
+            log.exception(error)
+            return
+        subreddit_streams = ModLogStreams(reddit_params, subreddits, redditor)
+        task = asyncio.create_task(subreddit_streams.run())
+        self.groups[redditor][frozenset(subreddits)] = subreddit_streams, task
+        log.info(f"Started streams for r/{'+'.join(subreddits)}")
+
+    async def _stop(self, redditor, group):
+        subreddit_streams, task = self.groups[redditor].pop(group)
+        subreddit_streams.stop()
+        try:
+            await task
+        except Exception as error:
+            log.exception(error)
+        log.info(f"Stopped streams for r/{'+'.join(sorted(group))}")
+
+    async def _refresh_rates(self, force=False):
+        if not force and (time.time() - self.last_rates) < self.rebalance_interval:
+            return
+        subreddits = set().union(*self.accounts.values())
+        try:
+            self.sharder.rates = await asyncio.get_running_loop().run_in_executor(None, load_rates, subreddits)
+            self.last_rates = time.time()
+        except Exception as error:
+            log.exception(error)
+
+    def _owned(self):
+        if self.leases is None:
+            return self.accounts
+        return {
+            redditor: {subreddit for subreddit in subreddits if self.leases.owns(subreddit)}
+            for redditor, subreddits in self.accounts.items()
+        }
+
+    async def reconcile(self, accounts=None, force_rates=False):
+        async with self.lock:
+            if accounts is not None:
+                self.accounts = accounts
+            await self._refresh_rates(force_rates)
+            accounts = self._owned()
+            for redditor in set(self.groups) | set(accounts):
+                running = self.groups[redditor]
+                for group in [group for group, (_, task) in running.items() if task.done()]:
+                    del running[group]
+                planned = self.sharder.plan(accounts.get(redditor, ()), running)
+                stale = [group for group in running if group not in planned]
+                await asyncio.gather(*[self._stop(redditor, group) for group in stale])
+                new = [group for group in planned if group not in running]
+                for group in new:
+                    await self._start(redditor, group)
+                if stale or new:
+                    log.info(
+                        f"u/{redditor}: {len(planned):,} pollers for {len(accounts.get(redditor, ())):,} subreddits, "
+                        f"{len(stale):,} stopped and {len(new):,} started"
+                    )
+                if not self.groups[redditor]:
+                    del self.groups[redditor]
+
+    async def rebalance(self):
+        while True:
+            await asyncio.sleep(self.rebalance_interval)
             try:
-                to_send = []
-                last_action = time.time()
-                modlogs = [
-                    self._log_wrapper("+".join(self.subreddits), admin, stream)
-                    for admin in [True, False]
-                    for stream in [True, False]
-                ]
-                combine = aiostream.stream.merge(*modlogs)
-                async with combine.stream() as modlog:
-                    has_admin = False
-                    async for action, admin, stream in modlog:
-                        try:
-                            data = map_values(action.__dict__, mapping, skip_keys)
-                            new = try_multiple(
-                                cache.add, (data["id"], 1), exception=pylibmc.Error, default_result=False
-                            )
-                            if new:
-                                to_send.append([data, admin, stream])
-                                has_admin = admin
-                                log.info(
-                                    f"Ingesting {data['subreddit']} | {data['moderator']} | {data['mod_action']} | {data['created_utc'].astimezone().strftime('%m-%d-%Y %I:%M:%S %p')}"
-                                )
-                            else:
-                                log.debug(
-                                    f"Already ingested {data['subreddit']} | {data['moderator']} | {data['mod_action']} | {data['created_utc'].astimezone().strftime('%m-%d-%Y %I:%M:%S %p')}"
-                                )
-                            if (
-                                len(to_send) >= 500
-                                or has_admin
-                                or (
-                                    (time.time() - last_action) > 10
-                                )  # send if last new action was more than 10 seconds ago
-                            ) and to_send:
-                                if len(to_send) > 20:
-                                    to_ingest = [to_send[x : x + 10] for x in range(0, len(to_send), 10)]
-                                    log.info(f"Sending {len(to_ingest):,} chunks with {len(to_send):,} actions")
-                                    for to_send in to_ingest:
-                                        ingest_action_chunk.apply_async(
-                                            args=(to_send,), priority=1, queue="action_chunks"
-                                        )
-                                else:
-                                    log.info(f"Sending 1 chunk with {len(to_send):,} actions")
-                                    ingest_action_chunk.apply_async(args=(to_send,), priority=1, queue="action_chunks")
-                                to_send = []
-                                has_admin = False
-                            if new:
-                                last_action = time.time()
-                        except asyncprawcore.ServerError as error:
-                            log.info(error)
-                            log.info((self.subreddits, await self.reddit.user.me()))
-                        except Exception as error:
-                            log.exception(error)
+                await self.reconcile(force_rates=True)
             except Exception as error:
                 log.exception(error)
 
@@ -125,47 +393,10 @@ def get_last_cache_reset():
 
 
 async def main():
-    subreddits = Subreddit.query.all()
-    accounts = defaultdict(set)
-    for subreddit in subreddits:
-        accounts[subreddit.modlog_account].add(subreddit.name)
-    streams = []
-    for redditor, subreddits in accounts.items():
-        subreddits = list(subreddits)
-        for chunk, subreddit_chunk in enumerate([subreddits[x : x + 3] for x in range(0, len(subreddits), 3)], 1):
-            streams.append(start_streaming(subreddit_chunk, redditor, chunk))
-    # if sys.platform != "darwin":
-    #     subreddits = services.reddit("Lil_SpazJoekp").user.me().moderated()
-    #     chunks = list(
-    #         zip_longest(
-    #             *[
-    #                 reversed(chunk) if i % 2 == 0 else chunk
-    #                 for i, chunk in enumerate([subreddits[x : x + 25] for x in range(0, len(subreddits), 25)])
-    #             ]
-    #         )
-    #     )
-    #     for chunk, subreddit_chunk in enumerate(chunks, 1):
-    #         streams.append(
-    #             start_streaming(
-    #                 [sub.display_name for sub in subreddit_chunk if sub], "Lil_SpazJoekp", chunk, other_auth=True
-    #             )
-    #         )
-    await asyncio.gather(*streams)
-
-
-async def start_streaming(subreddits, redditor, chunk, other_auth=False):
-    try:
-        log.info(f"Building chunk {chunk} for r/{'+'.join(subreddits)} using u/{redditor}...")
-        # if other_auth:
-        #     reddit = services.reddit(redditor, bot_name=f"SiouxBot_Log_Thread_{chunk}")
-        # else:
-        reddit = services.reddit(redditor)
-        reddit_params = reddit.config._settings
-        subreddit_streams = ModLogStreams(reddit_params, subreddits, redditor)
-        log.info(f"Starting streams for r/{'+'.join(subreddits)}")
-        await subreddit_streams.run()
-    except NotFound as error:
-        log.exception(error)
+    registry = SubredditRegistry()
+    leases = ShardLeases()
+    supervisor = StreamSupervisor(leases)
+    await asyncio.gather(registry.watch(supervisor.reconcile), supervisor.rebalance(), leases.run(supervisor.reconcile))
 
 
 def set_cache():
@@ -199,33 +430,15 @@ def set_last_cache_reset():
         f.write(f"{time.time()}")
 
 
-def set_webhooks():
-    to_set = {}
-    results = Webhook.query.session.execute(
-        """SELECT
-      subreddit,
-      array_to_string(array_agg(distinct admin_webhook),',') AS admin_webhooks,
-      array_to_string(array_agg(distinct alert_webhook),',') AS alert_webhooks
-    FROM webhooks GROUP BY subreddit;"""
-    )
-    subreddits = results.fetchall()
-    for subreddit, admin, alert in subreddits:
-        to_set[f"{subreddit}_admin_webhooks"] = admin.split(",")
-        to_set[f"{subreddit}_alert_webhooks"] = alert.split(",")
-    try:
-        cache.set_multi(to_set)
-    except Exception:
-        pass
-
-
 if __name__ == "__main__":
     freeze_support()
     loop = asyncio.get_event_loop()
     try:
-        if get_last_cache_reset() >= 86400:
+        if dedupe_mode == "cache" and get_last_cache_reset() >= 86400:
             cache.flush_all()
             set_cache()
-        set_webhooks()
+        install_triggers()
+        install_registry_triggers()
         asyncio.run(main())
     except Exception as error:
         log.exception(error)
@@ -1,22 +1,34 @@
+import math
 import os.path
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from functools import partial
-from itertools import zip_longest
 from multiprocessing import Process, freeze_support
 
 import praw
 import prawcore
-import pylibmc
 from credmgr.exceptions import NotFound
 from praw.endpoints import API_PATH
 
 from streams.tasks import ingest_action, ingest_action_chunk
-from streams.utils import ChunkGenerator, map_values, try_multiple
 
-from . import cache, connection_pool, log, mapping, services, skip_keys
-from .models import Subreddit, Webhook
+from . import cache, connection_pool, log, services, thread_cache
+from .activity import ActionLog
+from .cursors import BacklogCursors
+from .listings import ChunkGenerator
+from .models import Subreddit
+from .records import map_action
+from .retry import broker, memcached, reddit
+from .routing import install_triggers
+from .sharding import SubredditSharder, load_rates
+from .stream_config import (
+    backlog_interval,
+    backlog_prefetch,
+    sync_runtime,
+    sync_threads_per_process,
+    sync_worker_processes,
+)
 
 
 class ModLogStreams:
@@ -24,45 +36,65 @@ class ModLogStreams:
 
     def __init__(self, reddit_params, subreddit):
         self.reddit_params = reddit_params
+        self.reddit_retry = reddit(reddit_params.get("username"))
         self.subreddit = subreddit
         self.reddit = None
+        self.cursors = {}
+        self.activity_logs = {}
 
-    def _chunk(self, admin, modlog):
-        for chunk in modlog:
-            to_send = []
-            mapped = list(
-                map(partial(map_values, mapping=mapping, skip_keys=skip_keys), map(lambda item: item.__dict__, chunk))
+    def _activity(self, admin, stream):
+        key = (admin, stream)
+        if key not in self.activity_logs:
+            self.activity_logs[key] = ActionLog(
+                f"r/{self.subreddit} {'admin ' if admin else ''}{'stream' if stream else 'backlog'}"
             )
-            to_ingest = self.check_cache_multi(mapped)
-            log.debug(f"to_ingest: {len(to_ingest)}")
+        return self.activity_logs[key]
+
+    def _chunk(self, admin, modlog, walk, cursors):
+        activity = self._activity(admin, False)
+        # one cache lookup, one publish and one cursor checkpoint per page
+        for page in modlog:
+            to_send = []
+            records = [
+                data
+                for data in page
+                if not walk.is_known(data["subreddit"], data["id"], data["created_utc"].timestamp())
+            ]
+            to_ingest = self.check_cache_multi(records)
+            log.debug("to_ingest: %d", len(to_ingest))
+            new_ids = {data["id"] for data in to_ingest}
+            for data in records:
+                activity.record(data, data["id"] in new_ids, admin, stream=False)
             for to_ingest_chunk in [to_ingest[x : x + 10] for x in range(0, len(to_ingest), 10)]:
-                to_send.append([to_ingest_chunk, admin])
-                for data in to_ingest_chunk:
-                    log.info(
-                        f"Ingesting {data['subreddit']} | {data['moderator']} | {data['mod_action']} | {data['created_utc'].astimezone().strftime('%m-%d-%Y %I:%M:%S %p')}"
-                    )
-            log.debug(f"to_send: {len(to_send)}")
-            ingest_action_chunk.chunks(to_send, 10).apply_async(priority=(1 if admin else 0), queue="action_chunks")
-            cache.set_multi({action["id"]: 1 for action in to_ingest})
+                to_send.append(([[data, admin, False] for data in to_ingest_chunk],))
+            log.debug("to_send: %d", len(to_send))
+            if to_send:
+                broker.call(
+                    ingest_action_chunk.chunks(to_send, 10).apply_async,
+                    priority=(1 if admin else 0),
+                    queue="action_chunks",
+                )
+                memcached.call(thread_cache().set_multi, {action["id"]: 1 for action in to_ingest}, default=None)
+            walk.advance(page.after)
+            cursors.checkpoint()
+            if walk.finished:
+                modlog.close()
+                break
 
     def _stream(self, admin, modlog, stream):
         to_send = []
         last_action = time.time()
+        activity = self._activity(admin, stream)
         try:
             for action in modlog:
                 try:
                     if action:
-                        data = map_values(action.__dict__, mapping, skip_keys)
-                        new = try_multiple(cache.add, (data["id"], 1), exception=pylibmc.Error, default_result=False)
-                        if not new:
-                            to_send.append([data, admin, stream])
-                            log.info(
-                                f"Ingesting {data['subreddit']} | {data['moderator']} | {data['mod_action']} | {data['created_utc'].astimezone().strftime('%m-%d-%Y %I:%M:%S %p')}"
-                            )
-                        else:
-                            log.debug(
-                                f"Already ingested {data['subreddit']} | {data['moderator']} | {data['mod_action']} | {data['created_utc'].astimezone().strftime('%m-%d-%Y %I:%M:%S %p')}"
-                            )
+                        self.reddit_retry.succeeded()
+                        data = map_action(action.__dict__)
+                        new = memcached.call(thread_cache().add, data["id"], 1, default=False)
+                        if new:
+                            to_send.append([data, admin, stream, time.time()])
+                        activity.record(data, new, admin, stream)
                     if (
                         len(to_send) % 500 == 0
                         or len(to_send) > 500
@@ -70,28 +102,38 @@ class ModLogStreams:
                         or action is None
                         or (time.time() - last_action) > 5  # send if last action was more than 5 seconds ago
                     ) and to_send:
-                        ingest_action.chunks(to_send, 10).apply_async(
+                        broker.call(
+                            ingest_action.chunks(to_send, 10).apply_async,
                             priority=(2 if admin else 1),
-                            queue="actions",
+                            queue=("admin_actions" if admin else "actions"),
                         )
                         to_send = []
                     last_action = time.time()
                 except Exception as error:
                     log.exception(error)
             if to_send:
-                ingest_action.chunks(to_send, 10).apply_async(priority=(2 if admin else 1), queue="actions")
+                broker.call(
+                    ingest_action.chunks(to_send, 10).apply_async,
+                    priority=(2 if admin else 1),
+                    queue=("admin_actions" if admin else "actions"),
+                )
         except prawcore.ServerError as error:
             log.info(error)
+            self._reddit_failed()
             log.info((self.subreddit, self.reddit.user.me()))
         except Exception as error:
             log.exception(error)
+            self._reddit_failed()
+
+    def _reddit_failed(self):
+        # sleeping here only holds back this stream, and the breaker only this account's streams
+        self.reddit_retry.failed()
+        time.sleep(self.reddit_retry.delay(self.reddit_retry.breaker.failures))
 
     @staticmethod
     def check_cache_multi(items):
-        log.debug(f"checking {len(items)}")
-        cached_items = try_multiple(
-            cache.get_multi, ([item["id"] for item in items],), exception=pylibmc.Error, default_result=[]
-        )
+        log.debug("checking %d", len(items))
+        cached_items = memcached.call(thread_cache().get_multi, [item["id"] for item in items], default={})
         if len(cached_items) == len(items):
             return []
         to_ingest = []
@@ -100,8 +142,24 @@ class ModLogStreams:
                 to_ingest.append(item)
         return to_ingest
 
-    def _get_modlog(self, admin, stream):
-        self.reddit = praw.Reddit(**self.reddit_params, timeout=30)
+    def _backlog(self, admin):
+        mod_filter = "a" if admin else "-a"
+        cursors = self.cursors.get(mod_filter)
+        if cursors is None:
+            # loaded once, after that the in-memory cursors are ahead of the table
+            cursors = self.cursors[mod_filter] = BacklogCursors(self.subreddit.split("+"), [mod_filter])
+            cursors.load()
+        walk = cursors.walk(mod_filter)
+        for after in walk.segments():
+            modlog = self._get_modlog(admin, False, after=after)
+            self._chunk(admin, modlog, walk, cursors)
+        walk.finish()
+        cursors.checkpoint()
+
+    def _get_modlog(self, admin, stream, after=None):
+        # one instance per stream loop so its token and rate limit state carry over between listings
+        if self.reddit is None:
+            self.reddit = praw.Reddit(**self.reddit_params, timeout=30)
         subreddit = self.reddit.subreddit(self.subreddit)
         params = {}
         if admin:
@@ -114,8 +172,14 @@ class ModLogStreams:
             modlog = subreddit.mod.stream.log(**params)
         else:
             params["limit"] = None
+            if after:
+                params["after"] = after
             modlog = ChunkGenerator(
-                subreddit._reddit, API_PATH["about_log"].format(subreddit=subreddit), limit=None, params=params
+                subreddit._reddit,
+                API_PATH["about_log"].format(subreddit=subreddit),
+                limit=None,
+                params=params,
+                prefetch=backlog_prefetch,
             )
             # modlog = subreddit.mod.log
         # return modlog(**params)
@@ -123,10 +187,7 @@ class ModLogStreams:
 
     def admin_backlog(self):
         admin = True
-        stream = False
-        modlog = self._get_modlog(admin, stream)
-        # self._stream(admin, modlog, stream)
-        self._chunk(admin, modlog)
+        self._backlog(admin)
 
     def admin_stream(self):
         while True:
@@ -138,10 +199,8 @@ class ModLogStreams:
     def backlog(self):
         while True:
             admin = False
-            stream = False
-            modlog = self._get_modlog(admin, stream)
-            # self._stream(admin, modlog, stream)
-            self._chunk(admin, modlog)
+            self._backlog(admin)
+            time.sleep(backlog_interval)
 
     def stream(self):
         while True:
@@ -165,41 +224,33 @@ def get_last_cache_reset():
 
 def main():
     subreddits = Subreddit.query.all()
-    to_set = {}
     accounts = {}
     for subreddit in subreddits:
         accounts.setdefault(subreddit.modlog_account, [])
         accounts[subreddit.modlog_account].append(subreddit.name)
-        subreddit_webhooks = Webhook.query.get(subreddit.name)
-        if subreddit_webhooks:
-            for webhook_type in ["admin_webhook", "alert_webhook"]:
-                webhook = getattr(subreddit_webhooks, webhook_type)
-                if webhook:
-                    to_set[f"{subreddit.name}_{webhook_type}"] = webhook
-    cache.set_multi(to_set)
-    for redditor, subreddits in accounts.items():
-        for chunk, subreddit_chunk in enumerate([subreddits[x : x + 3] for x in range(0, len(subreddits), 3)]):
-            start_streaming("+".join(subreddit_chunk), redditor, chunk)
+    main_subreddits = []
     if sys.platform != "darwin":
-        subreddits = services.reddit("Lil_SpazJoekp").user.me().moderated()
-        chunks = list(
-            zip_longest(
-                *[
-                    reversed(chunk) if i % 2 == 0 else chunk
-                    for i, chunk in enumerate([subreddits[x : x + 10] for x in range(0, len(subreddits), 10)])
-                ]
-            )
-        )
-        for chunk, subreddit_chunk in enumerate(chunks, 1):
-            start_streaming(
-                "+".join([sub.display_name for sub in subreddit_chunk if sub]),
-                "Lil_SpazJoekp",
-                chunk,
-                other_auth=True,
-            )
+        main_subreddits = [sub.display_name for sub in services.reddit("Lil_SpazJoekp").user.me().moderated()]
+    sharder = SubredditSharder(load_rates([name for names in accounts.values() for name in names] + main_subreddits))
+    jobs = []
+    for redditor, subreddits in accounts.items():
+        for chunk, subreddit_chunk in enumerate(sharder.plan(subreddits)):
+            jobs.extend(start_streaming("+".join(sorted(subreddit_chunk)), redditor, chunk))
+    for chunk, subreddit_chunk in enumerate(sharder.plan(main_subreddits), 1):
+        jobs.extend(start_streaming("+".join(sorted(subreddit_chunk)), "Lil_SpazJoekp", chunk, other_auth=True))
+    if sync_runtime == "threads":
+        start_threaded(jobs)
+    else:
+        for job in jobs:
+            _, subreddit, stream = job
+            log.info(f"Starting {stream} for r/{subreddit}")
+            process = Process(target=run_stream, args=job, daemon=True)
+            process.start()
+            log.info(f"Started {stream} for r/{subreddit} (PID: {process.pid})")
 
 
 def start_streaming(subreddit, redditor, chunk, other_auth=False):
+    """Return a ``(reddit_params, subreddit, stream)`` job for each of the chunk's stream loops."""
     try:
         log.info(f"Building chunk {chunk} for r/{subreddit} using u/{redditor}...")
         if other_auth:
@@ -207,14 +258,36 @@ def start_streaming(subreddit, redditor, chunk, other_auth=False):
         else:
             reddit = services.reddit(redditor)
         reddit_params = reddit.config._settings
-        subreddit_streams = ModLogStreams(reddit_params, subreddit)
-        for stream in subreddit_streams.STREAMS:
-            log.info(f"Starting {stream} for r/{subreddit}")
-            process = Process(target=getattr(subreddit_streams, stream), daemon=True)
-            process.start()
-            log.info(f"Started {stream} for r/{subreddit} (PID: {process.pid})")
+        return [(reddit_params, subreddit, stream) for stream in ModLogStreams.STREAMS]
     except NotFound as error:
         log.exception(error)
+        return []
+
+
+def run_stream(reddit_params, subreddit, stream):
+    try:
+        getattr(ModLogStreams(reddit_params, subreddit), stream)()
+    except Exception as error:
+        log.exception(error)
+
+
+def run_threads(jobs):
+    # every loop gets its own thread and ModLogStreams instance (and so its own praw instance), the imports, broker
+    # connections and retry breakers are shared by the whole process
+    with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="stream") as executor:
+        futures = {executor.submit(run_stream, *job): job for job in jobs}
+        for future in as_completed(futures):
+            _, subreddit, stream = futures[future]
+            log.info(f"{stream} for r/{subreddit} finished")
+
+
+def start_threaded(jobs):
+    process_count = max(sync_worker_processes, math.ceil(len(jobs) / sync_threads_per_process))
+    groups = [jobs[x::process_count] for x in range(process_count)]
+    for i, group in enumerate([group for group in groups if group], 1):
+        process = Process(target=run_threads, args=(group,), daemon=True)
+        process.start()
+        log.info(f"Started stream worker {i} with {len(group):,} stream threads (PID: {process.pid})")
 
 
 def set_cache():
@@ -243,21 +316,6 @@ def set_last_cache_reset():
         f.write(f"{time.time()}")
 
 
-def set_webhooks():
-    subreddit_webhooks = Webhook.query.all()
-    to_set = {}
-    for subreddit_webhook in subreddit_webhooks:
-        if subreddit_webhook:
-            for webhook_type in ["admin_webhook", "alert_webhook"]:
-                webhook = getattr(subreddit_webhook, webhook_type)
-                if webhook:
-                    to_set[f"{subreddit_webhook.subreddit}_{webhook_type}"] = webhook
-    try:
-        cache.set_multi(to_set)
-    except Exception:
-        pass
-
-
 if __name__ == "__main__":
     freeze_support()
     try:
@@ -265,10 +323,9 @@ if __name__ == "__main__":
             cache.flush_all()
             set_cache()
             set_last_cache_reset()
-        set_webhooks()
+        install_triggers()
         main()
         while True:
-            set_webhooks()
             time.sleep(30)
     except Exception as error:
         log.exception(error)
@@ -1,7 +1,5 @@
-import itertools
 import textwrap
-import time
-from copy import copy
+from collections import Counter
 
 from discord import Embed
 
@@ -12,6 +10,7 @@ def convert_or_none(func):
             return func(arg)
         return None
 
+    wrapper.func = func
     return wrapper
 
 
@@ -35,6 +34,50 @@ def map_values(action_dict, mapping, skip_keys=None):
     return data
 
 
+def compile_mapping(mapping, columns, record, skip_keys=None):
+    """Compile a :func:`map_values` spec into a function building ``record`` from an action dict.
+
+    The returned function produces the same column values as ``map_values(action_dict, mapping, skip_keys)`` but
+    reads each source key once and calls the converters directly instead of walking the spec for every action.
+    """
+    if skip_keys is None:
+        skip_keys = []
+    sources = {}
+    for key, item_mapping in mapping.items():
+        if key in skip_keys:
+            continue
+        if isinstance(item_mapping, str):
+            sources[item_mapping] = (key, None)
+        elif isinstance(item_mapping, dict):
+            for sub_key, sub_mapping in item_mapping.items():
+                sources[sub_key] = (key, sub_mapping)
+        else:
+            sources[key] = (key, item_mapping)
+    namespace = {"_record": record}
+    lines = ["def map_action(action):", "    get = action.get"]
+    values = {}
+    for i, column in enumerate(columns):
+        key, converter = sources.get(column, (column, None))
+        if key in skip_keys:
+            lines.append(f"    c{i} = None")
+            continue
+        if key not in values:
+            values[key] = f"v{len(values)}"
+            lines.append(f"    {values[key]} = get({key!r})")
+        value = values[key]
+        if converter is None:
+            lines.append(f"    c{i} = {value}")
+        elif hasattr(converter, "func"):
+            namespace[f"_f{i}"] = converter.func
+            lines.append(f"    c{i} = _f{i}({value}) if {value} else None")
+        else:
+            namespace[f"_f{i}"] = converter
+            lines.append(f"    c{i} = _f{i}({value}) if {value} is not None else None")
+    lines.append(f"    return _record({', '.join(f'c{i}' for i in range(len(columns)))})")
+    exec("\n".join(lines), namespace)
+    return namespace["map_action"]
+
+
 def gen_action_embed(action):
 
     embed = Embed()
@@ -75,52 +118,21 @@ def gen_action_embed(action):
     return embed, get_more
 
 
-def generate_sub_chunks(subreddits, chunk_size=25):
-    modded_subs = copy(subreddits)
-    modded_subs_final = copy(subreddits)
-    modded_subs_final.sort()
-    i = True
-    while i:
-        first_section = [modded_subs[x : x + chunk_size] for x in range(0, len(modded_subs), chunk_size)][0]
-        if "dankmemes" in first_section and len(modded_subs) > chunk_size:
-            i = "dankmemes" in first_section
-        else:
-            i = False
-        modded_subs = [
-            sub
-            for tup in [
-                i
-                for i in itertools.zip_longest(
-                    modded_subs[: len(modded_subs) // 2], reversed(modded_subs[len(modded_subs) // 2 :])
-                )
-            ]
-            for sub in tup
-            if sub
-        ]
-    return modded_subs, modded_subs_final
-
-
-def try_multiple(func, args=None, kwargs=None, wait_time=3, max_attempts=3, default_result=None, exception=Exception):
-    from . import log
-
-    if not args:
-        args = ()
-    if not kwargs:
-        kwargs = {}
-    try:
-        result = func(*args, **kwargs)
-    except exception as error:
-        attempts = 0
-        while attempts < max_attempts:
-            try:
-                result = func(*args, **kwargs)
-                break
-            except exception:
-                pass
-            log.warning(f"Waiting {wait_time} seconds before trying again")
-            time.sleep(wait_time)
-            attempts += 1
-        else:
-            log.exception(error)
-            result = default_result
-    return result
+def gen_alert_summary(actions, shown):
+    """Build the embed summarizing a burst of admin actions, ``shown`` of which are sent in full."""
+    moderators = Counter(action["moderator"] for action in actions)
+    mod_actions = Counter(action["mod_action"] for action in actions)
+    subreddits = sorted({action["subreddit"] for action in actions})
+    embed = Embed(title=f"{len(actions):,} Admin Actions")
+    embed.description = (
+        f"In {', '.join(f'r/{subreddit}' for subreddit in subreddits)}\n"
+        f"Showing {shown:,} of them below, anything not shown is in the mod log"
+    )
+    for name, counter in [("Moderators", moderators), ("Actions", mod_actions)]:
+        embed.add_field(name=name, value="\n".join(f"{key}: {count:,}" for key, count in counter.most_common(10)))
+    created = sorted(action["created_utc"] for action in actions)
+    time_format = "%B %d, %Y at %I:%M:%S %p %Z"
+    embed.set_footer(
+        text=f"{created[0].astimezone().strftime(time_format)} - {created[-1].astimezone().strftime(time_format)}"
+    )
+    return embed
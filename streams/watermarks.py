@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from psycopg2.extras import execute_values
+
+from . import ConnectionManager, connection_pool, log
+from .stream_config import watermark_grace, watermark_retention
+
+CREATE_QUERY = """CREATE TABLE IF NOT EXISTS mirror.stream_watermarks(
+                      subreddit TEXT PRIMARY KEY,
+                      high_water TIMESTAMPTZ,
+                      boundary_ids TEXT[] NOT NULL DEFAULT '{}',
+                      updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                  );
+                  """
+LOAD_QUERY = "SELECT subreddit, high_water, boundary_ids FROM mirror.stream_watermarks WHERE subreddit=ANY(%s);"
+SAVE_QUERY = """INSERT INTO mirror.stream_watermarks(subreddit, high_water, boundary_ids) VALUES %s
+                ON CONFLICT (subreddit) DO UPDATE SET
+                    high_water=EXCLUDED.high_water, boundary_ids=EXCLUDED.boundary_ids, updated_at=now();
+                """
+
+
+class SubredditWatermark:
+    __slots__ = ("subreddit", "committed", "high_water", "recent")
+
+    def __init__(self, subreddit, committed=None, boundary_ids=()):
+        self.subreddit = subreddit
+        # everything older than `committed` (minus the grace window) is known to be in the database
+        self.committed = committed
+        # newest action published during this run
+        self.high_water = committed
+        self.recent = {action_id: committed for action_id in boundary_ids}
+
+    def is_new(self, action_id, created_utc):
+        if action_id in self.recent:
+            return False
+        if self.committed is not None and created_utc < self.committed - timedelta(seconds=watermark_grace):
+            return False
+        self.recent[action_id] = created_utc
+        return True
+
+    def published(self, created_utc):
+        if self.high_water is None or created_utc > self.high_water:
+            self.high_water = created_utc
+
+    def prune(self):
+        if self.high_water is None:
+            return
+        cutoff = self.high_water - timedelta(seconds=watermark_retention)
+        self.recent = {
+            action_id: created_utc
+            for action_id, created_utc in self.recent.items()
+            if created_utc is None or created_utc >= cutoff
+        }
+
+    def boundary_ids(self):
+        if self.committed is None:
+            return []
+        cutoff = self.committed - timedelta(seconds=watermark_grace)
+        return [
+            action_id for action_id, created_utc in self.recent.items() if created_utc is None or created_utc >= cutoff
+        ]
+
+
+class Watermarks:
+    """High-water mark dedupe for the subreddits of one stream.
+
+    The committed mark only moves forward once the backlog walk of the current run has finished, so a crash
+    mid-backlog never marks unread history as ingested.
+    """
+
+    def __init__(self, subreddits, backlogs=1, pool=connection_pool):
+        self.subreddits = [subreddit.lower() for subreddit in subreddits]
+        self.pool = pool
+        self.marks = {subreddit: SubredditWatermark(subreddit) for subreddit in self.subreddits}
+        self.pending_backlogs = backlogs
+
+    def _get(self, subreddit):
+        subreddit = subreddit.lower()
+        mark = self.marks.get(subreddit)
+        if mark is None:
+            mark = self.marks[subreddit] = SubredditWatermark(subreddit)
+        return mark
+
+    def load(self):
+        with ConnectionManager(self.pool) as sql:
+            sql.execute(CREATE_QUERY)
+            sql.execute(LOAD_QUERY, (self.subreddits,))
+            for result in sql.fetchall():
+                self.marks[result.subreddit] = SubredditWatermark(
+                    result.subreddit, result.high_water, result.boundary_ids
+                )
+        log.info(f"Loaded watermarks for {len(self.marks):,} subreddits")
+
+    def is_new(self, data):
+        return self._get(data["subreddit"]).is_new(data["id"], data["created_utc"])
+
+    def published(self, actions):
+        for data, _, _ in actions:
+            self._get(data["subreddit"]).published(data["created_utc"])
+
+    def backlog_complete(self):
+        self.pending_backlogs -= 1
+
+    def snapshot(self):
+        backlog_done = self.pending_backlogs <= 0
+        rows = []
+        for mark in self.marks.values():
+            if backlog_done:
+                mark.committed = mark.high_water
+            mark.prune()
+            if mark.committed is not None:
+                rows.append((mark.subreddit, mark.committed, mark.boundary_ids()))
+        return rows
+
+    def save(self, rows):
+        if rows:
+            with ConnectionManager(self.pool) as sql:
+                execute_values(sql, SAVE_QUERY, rows)
+        log.debug(f"Checkpointed {len(rows):,} watermarks")
+
+    def checkpoint(self):
+        self.save(self.snapshot())
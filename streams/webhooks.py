@@ -0,0 +1,82 @@
+import asyncio
+import os
+import threading
+
+from webhook_dispatcher import MAX_EMBED_CHARACTERS, MAX_EMBEDS, WebhookDispatcher
+
+from . import log
+from .stream_config import (
+    alert_max_messages,
+    webhook_connection_limit,
+    webhook_max_attempts,
+    webhook_report_interval,
+)
+
+
+def pack_alerts(items, summarize, max_messages=alert_max_messages):
+    """Split ``(item, embed)`` pairs into the messages to send, as ``(embeds, items)`` pairs.
+
+    Messages hold up to 10 embeds and 6000 characters. A burst that needs more than one message leads with
+    ``summarize(items, shown)``, and one that needs more than ``max_messages`` is cut there with the summary's message
+    covering the items that weren't sent in full.
+    """
+
+    def pack(entries):
+        messages = []
+        size = 0
+        for entry in entries:
+            embed_size = len(entry[1])
+            if not messages or len(messages[-1]) == MAX_EMBEDS or size + embed_size > MAX_EMBED_CHARACTERS:
+                messages.append([])
+                size = 0
+            messages[-1].append(entry)
+            size += embed_size
+        return messages
+
+    messages = pack(items)
+    cut = []
+    if len(messages) > 1:
+        all_items = [item for item, _ in items]
+        messages = pack([(None, summarize(all_items, len(items)))] + list(items))
+        if len(messages) > max_messages:
+            cut = [item for message in messages[max_messages:] for item, _ in message]
+            messages = messages[:max_messages]
+            messages[0][0] = (None, summarize(all_items, len(items) - len(cut)))
+    packed = [
+        ([embed for _, embed in message], [item for item, _ in message if item is not None]) for message in messages
+    ]
+    if cut:
+        packed[0][1].extend(cut)
+    return packed
+
+
+class WebhookClient:
+    """Blocking front end to a :class:`WebhookDispatcher` running on a background event loop.
+
+    Celery tasks in the same worker process share the loop, its keep-alive session and rate limit buckets. The loop is
+    started on first use in each process, so it's safe to create before the worker forks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._dispatcher = None
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._dispatcher = WebhookDispatcher(
+                max_attempts=webhook_max_attempts,
+                report_interval=webhook_report_interval,
+                connection_limit=webhook_connection_limit,
+                logger=log,
+            )
+            threading.Thread(target=self._loop.run_forever, name="webhooks", daemon=True).start()
+            self._pid = os.getpid()
+
+    def send(self, url, timeout=120, **kwargs):
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._dispatcher.send(url, **kwargs), self._loop).result(timeout)
@@ -0,0 +1,87 @@
+import io
+
+from psycopg2.extras import execute_values
+
+from .records import COLUMNS
+
+CHUNK_QUERY = f"""INSERT INTO mirror.modlog({", ".join(COLUMNS)}, pinged, query_action)
+                 VALUES %s
+                 ON CONFLICT (id, created_utc) DO UPDATE SET query_action='updated'
+                 RETURNING id, (query_action='insert') as new, pinged;
+                 """
+# temporary tables are never WAL-logged and ON COMMIT DELETE ROWS empties this one after every merge
+STAGING_QUERY = (
+    """CREATE TEMP TABLE IF NOT EXISTS modlog_staging (LIKE mirror.modlog INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;"""
+)
+COPY_QUERY = f"COPY modlog_staging({', '.join(COLUMNS)}) FROM STDIN"
+# rows inserted by the CTE aren't visible to the outer SELECT, so existing rows keep their pinged flag and new rows
+# come back with pinged NULL. The created_utc range on the join lets the planner prune modlog's monthly partitions.
+MERGE_QUERY = f"""WITH inserted AS (
+                     INSERT INTO mirror.modlog({", ".join(COLUMNS)}, pinged, query_action)
+                     SELECT DISTINCT ON (id, created_utc) {", ".join(COLUMNS)}, false, 'insert' FROM modlog_staging
+                     ON CONFLICT (id, created_utc) DO NOTHING RETURNING id
+                 )
+                 SELECT staged.id, inserted.id IS NOT NULL AS new, coalesce(modlog.pinged, false) AS pinged
+                 FROM (SELECT DISTINCT id, created_utc FROM modlog_staging) staged
+                 LEFT JOIN inserted ON inserted.id=staged.id
+                 LEFT JOIN mirror.modlog modlog ON modlog.id=staged.id AND modlog.created_utc=staged.created_utc
+                     AND modlog.created_utc BETWEEN %s AND %s
+                 WHERE inserted.id IS NOT NULL OR staged.id=ANY(%s);
+                 """
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _results(actions, results):
+    admin_ids = {data["id"] for data, admin, _ in actions if admin}
+    new_ids = set()
+    to_ping = set()
+    for result in results:
+        if result.new:
+            new_ids.add(result.id)
+        if result.id in admin_ids and not result.pinged:
+            to_ping.add(result.id)
+    return new_ids, to_ping
+
+
+def upsert_actions(sql, actions):
+    results = execute_values(
+        sql,
+        CHUNK_QUERY,
+        [tuple([data.get(key, None) for key in COLUMNS] + [False, "insert"]) for data, _, _ in actions],
+        fetch=True,
+    )
+    return _results(actions, results)
+
+
+def copy_actions(sql, actions):
+    """COPY ``actions`` into a session staging table and merge them into ``mirror.modlog`` without updating rows.
+
+    Returns the ids that were newly inserted and the ids of admin actions that haven't been pinged yet.
+    """
+    buffer = io.StringIO()
+    for data, _, _ in actions:
+        buffer.write("\t".join([_copy_value(data.get(key, None)) for key in COLUMNS]))
+        buffer.write("\n")
+    buffer.seek(0)
+    sql.execute(STAGING_QUERY)
+    sql.execute("BEGIN;")
+    try:
+        sql.copy_expert(COPY_QUERY, buffer)
+        created = [data["created_utc"] for data, _, _ in actions]
+        sql.execute(MERGE_QUERY, (min(created), max(created), [data["id"] for data, admin, _ in actions if admin]))
+        results = sql.fetchall()
+        sql.execute("COMMIT;")
+    except Exception:
+        sql.execute("ROLLBACK;")
+        raise
+    return _results(actions, results)
+
+
+WRITERS = {"copy": copy_actions, "upsert": upsert_actions}
@@ -0,0 +1,79 @@
+"""Runs the mirror.modlog partitioning against a real Postgres database.
+
+Point ``STREAMS_TEST_DSN`` at a throwaway database, the tests drop and recreate its ``mirror`` schema.
+"""
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytestmark = pytest.mark.skipif(not os.environ.get("STREAMS_TEST_DSN"), reason="STREAMS_TEST_DSN isn't set")
+
+
+@pytest.fixture
+def sql():
+    from psycopg2.extras import NamedTupleCursor
+
+    conn = psycopg2.connect(os.environ["STREAMS_TEST_DSN"], cursor_factory=NamedTupleCursor)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("DROP SCHEMA IF EXISTS mirror CASCADE;")
+    cursor.execute("CREATE SCHEMA mirror;")
+    cursor.execute(
+        """CREATE TABLE mirror.modlog(
+               id TEXT NOT NULL,
+               created_utc TIMESTAMPTZ NOT NULL,
+               pinged BOOLEAN NOT NULL DEFAULT false,
+               PRIMARY KEY (id, created_utc)
+           );
+           """
+    )
+    cursor.execute(
+        "INSERT INTO mirror.modlog(id, created_utc) VALUES ('old', '2020-01-15'), ('recent', now() - interval '1 day');"
+    )
+    yield cursor
+    cursor.execute("DROP SCHEMA IF EXISTS mirror CASCADE;")
+    conn.close()
+
+
+def _names(sql):
+    from streams.partitions import list_partitions
+
+    return {partition.name for partition in list_partitions(sql)}
+
+
+def test_partition_modlog_keeps_rows_in_legacy(sql):
+    from streams.partitions import add_months, is_partitioned, month_start, partition_modlog, partition_name
+
+    boundary = partition_modlog(sql, months_ahead=3)
+
+    assert is_partitioned(sql)
+    assert boundary == add_months(month_start(datetime.now(timezone.utc)), 1)
+    assert _names(sql) == {"modlog_legacy"} | {partition_name(add_months(boundary, month)) for month in range(3)}
+    sql.execute("SELECT count(*) AS rows FROM mirror.modlog_legacy;")
+    assert sql.fetchone().rows == 2
+    sql.execute("INSERT INTO mirror.modlog(id, created_utc) VALUES ('new', %s);", (boundary,))
+    sql.execute("SELECT tableoid::regclass::text AS partition FROM mirror.modlog WHERE id='new';")
+    assert sql.fetchone().partition == f"mirror.{partition_name(boundary)}"
+
+
+def test_partition_modlog_twice_is_a_no_op(sql):
+    from streams.partitions import partition_modlog
+
+    partition_modlog(sql)
+    assert partition_modlog(sql) is None
+
+
+def test_ensure_partitions_fills_missing_months(sql):
+    from streams.partitions import add_months, ensure_partitions, partition_modlog, partition_name
+
+    boundary = partition_modlog(sql, months_ahead=3)
+    missing = partition_name(add_months(boundary, 1))
+    sql.execute(f"DROP TABLE mirror.{missing};")
+
+    through = ensure_partitions(sql, add_months(boundary, 2), months_ahead=1)
+
+    assert missing in _names(sql)
+    assert through == add_months(boundary, 4)
+    assert partition_name(add_months(boundary, 3)) in _names(sql)
@@ -0,0 +1,166 @@
+"""Discord webhook delivery shared by the bot and the stream workers.
+
+Kept outside the ``streams`` package, whose import connects to the databases and memcached, so the bot can use it.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+
+import aiohttp
+
+# Discord's limits for one webhook message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
+
+
+class WebhookRejected(Exception):
+    """Discord refused the message (4xx other than 429), sending it again won't change that."""
+
+
+class WebhookBucket:
+    """Rate limit state of one webhook, kept in sync with Discord's ``X-RateLimit-*`` headers.
+
+    Until the first response arrives a webhook is allowed one request at a time.
+    """
+
+    def __init__(self):
+        self.remaining = 1
+        self.reset_at = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        while self.remaining <= 0:
+            delay = self.reset_at - time.monotonic()
+            if delay <= 0:
+                self.remaining = 1
+                break
+            await asyncio.sleep(delay)
+        self.remaining -= 1
+
+    def update(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            self.remaining = int(remaining)
+        if reset_after is not None:
+            self.reset_at = time.monotonic() + float(reset_after)
+
+    def limited(self, retry_after):
+        self.remaining = 0
+        self.reset_at = time.monotonic() + retry_after
+
+
+class WebhookDispatcher:
+    """Delivers webhook messages over one keep-alive session with a rate limit bucket per webhook.
+
+    Sends to the same webhook are serialized through its bucket, different webhooks go out concurrently. 429s wait out
+    the ``retry_after`` Discord returns (for every webhook when it's the global limit), connection errors and 5xx
+    responses are retried with backoff, and 4xx responses fail right away since resending won't change them. Pass the
+    bot's ``session`` to share it, otherwise one is created on first use. Logs go to ``logger``, this module's logger
+    by default.
+    """
+
+    def __init__(self, session=None, max_attempts=5, report_interval=60, connection_limit=20, logger=None):
+        self.session = session
+        self.owns_session = session is None
+        self.max_attempts = max_attempts
+        self.report_interval = report_interval
+        self.connection_limit = connection_limit
+        self.log = logger or logging.getLogger(__name__)
+        self.buckets = {}
+        self.global_reset_at = 0
+        self.stats = Counter()
+        self.last_report = time.monotonic()
+
+    def _bucket(self, url):
+        key = url.split("/webhooks/", 1)[-1].split("/", 1)[0]
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = WebhookBucket()
+        return bucket
+
+    async def _session(self):
+        if self.session is None or (self.owns_session and self.session.closed):
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self.session
+
+    @staticmethod
+    def _payload(content, embeds, username, avatar_url):
+        payload = {}
+        if content is not None:
+            payload["content"] = str(content)
+        if embeds:
+            payload["embeds"] = [embed.to_dict() if hasattr(embed, "to_dict") else embed for embed in embeds]
+        if username:
+            payload["username"] = username
+        if avatar_url:
+            payload["avatar_url"] = avatar_url
+        return payload
+
+    async def send(self, url, content=None, embeds=None, username=None, avatar_url=None):
+        """Send a message to the webhook at ``url``. Returns whether it was delivered, raises :class:`WebhookRejected`
+        when Discord refuses it."""
+        payload = self._payload(content, embeds, username, avatar_url)
+        bucket = self._bucket(url)
+        session = await self._session()
+        try:
+            async with bucket.lock:
+                for attempt in range(self.max_attempts):
+                    global_delay = self.global_reset_at - time.monotonic()
+                    if global_delay > 0:
+                        await asyncio.sleep(global_delay)
+                    await bucket.acquire()
+                    try:
+                        async with session.post(url, json=payload) as response:
+                            bucket.update(response.headers)
+                            if response.status == 429:
+                                data = await response.json(content_type=None)
+                                retry_after = float(data.get("retry_after", 1))
+                                if data.get("global") or response.headers.get("X-RateLimit-Global"):
+                                    self.global_reset_at = time.monotonic() + retry_after
+                                else:
+                                    bucket.limited(retry_after)
+                                self.stats["rate_limited"] += 1
+                                continue
+                            if response.status >= 500:
+                                self.stats["retried"] += 1
+                                await asyncio.sleep(self._delay(attempt))
+                                continue
+                            if response.status >= 400:
+                                self.stats["rejected"] += 1
+                                webhook = url.rsplit("/", 1)[0]
+                                raise WebhookRejected(f"Webhook {webhook} rejected a message: {response.status}")
+                            self.stats["sent"] += 1
+                            return True
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                        self.log.warning(f"Webhook request failed: {error!r}")
+                        self.stats["retried"] += 1
+                        await asyncio.sleep(self._delay(attempt))
+                self.stats["failed"] += 1
+                return False
+        finally:
+            self._report()
+
+    @staticmethod
+    def _delay(attempt):
+        return random.uniform(0, min(30, 2**attempt))
+
+    def _report(self):
+        elapsed = time.monotonic() - self.last_report
+        if elapsed < self.report_interval:
+            return
+        self.last_report = time.monotonic()
+        if self.stats:
+            counters = " | ".join(f"{key} {value:,}" for key, value in sorted(self.stats.items()))
+            self.log.info(f"Webhooks | {self.stats['sent'] / elapsed:,.2f} sent/s | {counters}")
+        self.stats.clear()
+
+    async def close(self):
+        # a session passed in belongs to its owner, the bot closes its own
+        if self.owns_session and self.session is not None:
+            await self.session.close()